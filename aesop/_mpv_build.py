@@ -0,0 +1,196 @@
+"""Out-of-line cffi build for the mpv binding.
+
+Run on install through setup.py's cffi_modules, producing the compiled
+`aesop._mpv` extension that `aesop.mpv` imports. Can also be run directly to
+build it in place: python aesop/_mpv_build.py
+"""
+
+import re
+
+from cffi import FFI
+
+definitions = """
+unsigned long mpv_client_api_version(void);
+typedef struct mpv_handle mpv_handle;
+typedef enum mpv_error {
+    MPV_ERROR_SUCCESS = 0,
+    MPV_ERROR_EVENT_QUEUE_FULL = -1,
+    MPV_ERROR_NOMEM = -2,
+    MPV_ERROR_UNINITIALIZED = -3,
+    MPV_ERROR_INVALID_PARAMETER = -4,
+    MPV_ERROR_OPTION_NOT_FOUND = -5,
+    MPV_ERROR_OPTION_FORMAT = -6,
+    MPV_ERROR_OPTION_ERROR = -7,
+    MPV_ERROR_PROPERTY_NOT_FOUND = -8,
+    MPV_ERROR_PROPERTY_FORMAT = -9,
+    MPV_ERROR_PROPERTY_UNAVAILABLE = -10,
+    MPV_ERROR_PROPERTY_ERROR = -11,
+    MPV_ERROR_COMMAND = -12,
+    MPV_ERROR_LOADING_FAILED = -13,
+    MPV_ERROR_AO_INIT_FAILED = -14,
+    MPV_ERROR_VO_INIT_FAILED = -15,
+    MPV_ERROR_NOTHING_TO_PLAY = -16,
+    MPV_ERROR_UNKNOWN_FORMAT = -17,
+    MPV_ERROR_UNSUPPORTED = -18,
+    MPV_ERROR_NOT_IMPLEMENTED = -19
+} mpv_error;
+const char *mpv_error_string(int error);
+void mpv_free(void *data);
+const char *mpv_client_name(mpv_handle *ctx);
+mpv_handle *mpv_create(void);
+int mpv_initialize(mpv_handle *ctx);
+void mpv_terminate_destroy(mpv_handle *ctx);
+mpv_handle *mpv_create_client(mpv_handle *ctx, const char *name);
+int mpv_load_config_file(mpv_handle *ctx, const char *filename);
+int64_t mpv_get_time_us(mpv_handle *ctx);
+typedef enum mpv_format {
+    MPV_FORMAT_NONE = 0,
+    MPV_FORMAT_STRING = 1,
+    MPV_FORMAT_OSD_STRING = 2,
+    MPV_FORMAT_FLAG = 3,
+    MPV_FORMAT_INT64 = 4,
+    MPV_FORMAT_DOUBLE = 5,
+    MPV_FORMAT_NODE = 6,
+    MPV_FORMAT_NODE_ARRAY = 7,
+    MPV_FORMAT_NODE_MAP = 8,
+    MPV_FORMAT_BYTE_ARRAY = 9
+} mpv_format;
+typedef struct mpv_node {
+    union {
+        char *string;
+        int flag;
+        int64_t int64;
+        double double_;
+        struct mpv_node_list *list;
+        struct mpv_byte_array *ba;
+    } u;
+    mpv_format format;
+} mpv_node;
+typedef struct mpv_node_list {
+    int num;
+    mpv_node *values;
+    char **keys;
+} mpv_node_list;
+typedef struct mpv_byte_array {
+    void *data;
+    size_t size;
+} mpv_byte_array;
+void mpv_free_node_contents(mpv_node *node);
+int mpv_set_option(mpv_handle *ctx, const char *name, mpv_format format,
+                   void *data);
+int mpv_set_option_string(mpv_handle *ctx, const char *name, const char *data);
+int mpv_command(mpv_handle *ctx, const char **args);
+int mpv_command_node(mpv_handle *ctx, mpv_node *args, mpv_node *result);
+int mpv_command_string(mpv_handle *ctx, const char *args);
+int mpv_command_async(mpv_handle *ctx, uint64_t reply_userdata,
+                      const char **args);
+int mpv_command_node_async(mpv_handle *ctx, uint64_t reply_userdata,
+                           mpv_node *args);
+int mpv_set_property(mpv_handle *ctx, const char *name, mpv_format format,
+                     void *data);
+int mpv_set_property_string(mpv_handle *ctx, const char *name, const char *data);
+int mpv_set_property_async(mpv_handle *ctx, uint64_t reply_userdata,
+                           const char *name, mpv_format format, void *data);
+int mpv_get_property(mpv_handle *ctx, const char *name, mpv_format format,
+                     void *data);
+char *mpv_get_property_string(mpv_handle *ctx, const char *name);
+char *mpv_get_property_osd_string(mpv_handle *ctx, const char *name);
+int mpv_get_property_async(mpv_handle *ctx, uint64_t reply_userdata,
+                           const char *name, mpv_format format);
+int mpv_observe_property(mpv_handle *mpv, uint64_t reply_userdata,
+                         const char *name, mpv_format format);
+int mpv_unobserve_property(mpv_handle *mpv, uint64_t registered_reply_userdata);
+typedef enum mpv_event_id {
+    MPV_EVENT_NONE = 0,
+    MPV_EVENT_SHUTDOWN = 1,
+    MPV_EVENT_LOG_MESSAGE = 2,
+    MPV_EVENT_GET_PROPERTY_REPLY = 3,
+    MPV_EVENT_SET_PROPERTY_REPLY = 4,
+    MPV_EVENT_COMMAND_REPLY = 5,
+    MPV_EVENT_START_FILE = 6,
+    MPV_EVENT_END_FILE = 7,
+    MPV_EVENT_FILE_LOADED = 8,
+    MPV_EVENT_CLIENT_MESSAGE = 16,
+    MPV_EVENT_VIDEO_RECONFIG = 17,
+    MPV_EVENT_AUDIO_RECONFIG = 18,
+    MPV_EVENT_SEEK = 20,
+    MPV_EVENT_PLAYBACK_RESTART = 21,
+    MPV_EVENT_PROPERTY_CHANGE = 22,
+    MPV_EVENT_QUEUE_OVERFLOW = 24
+} mpv_event_id;
+const char *mpv_event_name(mpv_event_id event);
+typedef struct mpv_event_property {
+    const char *name;
+    mpv_format format;
+    void *data;
+} mpv_event_property;
+typedef enum mpv_log_level {
+    MPV_LOG_LEVEL_NONE = 0,
+    MPV_LOG_LEVEL_FATAL = 10,
+    MPV_LOG_LEVEL_ERROR = 20,
+    MPV_LOG_LEVEL_WARN = 30,
+    MPV_LOG_LEVEL_INFO = 40,
+    MPV_LOG_LEVEL_V = 50,
+    MPV_LOG_LEVEL_DEBUG = 60,
+    MPV_LOG_LEVEL_TRACE = 70,
+} mpv_log_level;
+typedef struct mpv_event_log_message {
+    const char *prefix;
+    const char *level;
+    const char *text;
+    mpv_log_level log_level;
+} mpv_event_log_message;
+typedef enum mpv_end_file_reason {
+    MPV_END_FILE_REASON_EOF = 0,
+    MPV_END_FILE_REASON_STOP = 2,
+    MPV_END_FILE_REASON_QUIT = 3,
+    MPV_END_FILE_REASON_ERROR = 4,
+} mpv_end_file_reason;
+typedef struct mpv_event_end_file {
+    int reason;
+    int error;
+} mpv_event_end_file;
+typedef struct mpv_event_client_message {
+    int num_args;
+    const char **args;
+} mpv_event_client_message;
+typedef struct mpv_event {
+    mpv_event_id event_id;
+    int error;
+    uint64_t reply_userdata;
+    void *data;
+} mpv_event;
+int mpv_request_event(mpv_handle *ctx, mpv_event_id event, int enable);
+int mpv_request_log_messages(mpv_handle *ctx, const char *min_level);
+mpv_event *mpv_wait_event(mpv_handle *ctx, double timeout);
+void mpv_wakeup(mpv_handle *ctx);
+void mpv_set_wakeup_callback(mpv_handle *ctx, void (*cb)(void *d), void *d);
+int mpv_get_wakeup_pipe(mpv_handle *ctx);
+void mpv_wait_async_requests(mpv_handle *ctx);
+
+"""
+
+
+def partial(definitions):
+    """Return the definitions with struct layouts and enum values left for
+    the compiler to fill in from the real header, for API mode. ABI mode has
+    no compiler, so it needs the exact definitions above."""
+    # enum values.
+    definitions = re.sub(r'^(\s+\w+) = -?\d+,?$', r'\1,', definitions, flags=re.M)
+    definitions = re.sub(
+        r'^(typedef enum (\w+) \{\n.*?)\n\} \2;$', r'\1\n    ...\n} \2;',
+        definitions, flags=re.M | re.S)
+    # struct members beyond the ones used, and their layout.
+    definitions = re.sub(
+        r'^(typedef struct (\w+) \{\n.*?)\n\} \2;$', r'\1\n    ...;\n} \2;',
+        definitions, flags=re.M | re.S)
+    return definitions
+
+
+ffibuilder = FFI()
+ffibuilder.cdef(partial(definitions))
+ffibuilder.set_source('aesop._mpv', '#include <mpv/client.h>', libraries=['mpv'])
+
+
+if __name__ == '__main__':
+    ffibuilder.compile(verbose=True)
@@ -0,0 +1,137 @@
+"""Build content-hashed, precompressed copies of the static assets.
+
+Run with `python -m aesop.assets` after changing anything under
+`aesop/static/css` or `aesop/static/js`. The fingerprinted files are written
+to `aesop/static/dist`, alongside `.gz` (and `.br`, if the brotli module is
+available) copies, and `templates/index.html` is rewritten to
+`templates/index.dist.html` to reference them.
+"""
+
+import gzip
+import hashlib
+import json
+import pathlib
+import re
+
+from logbook import Logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = Logger('aesop.assets')
+
+ROOT = pathlib.Path(__file__).parent
+STATIC = ROOT / 'static'
+DIST = STATIC / 'dist'
+TEMPLATES = ROOT / 'templates'
+MANIFEST = DIST / 'manifest.json'
+
+ASSET_DIRECTORIES = ['css', 'js']
+COMPRESSIBLE = {'.css', '.js'}
+
+# anything smaller than this isn't worth the extra files.
+MIN_COMPRESS_SIZE = 256
+
+
+def fingerprint(data):
+    return hashlib.md5(data).hexdigest()[:12]
+
+
+def hashed_name(path, digest):
+    """Return `path` with `digest` inserted before the real suffix, so
+    `bootstrap.min.css` becomes `bootstrap.min.<digest>.css`."""
+    return path.with_name('{}.{}{}'.format(path.stem, digest, path.suffix))
+
+
+def compress(path, data):
+    if path.suffix not in COMPRESSIBLE or len(data) < MIN_COMPRESS_SIZE:
+        return
+
+    gzipped = gzip.compress(data, compresslevel=9)
+    if len(gzipped) < len(data):
+        path.with_name(path.name + '.gz').write_bytes(gzipped)
+
+    if brotli is not None:
+        compressed = brotli.compress(data)
+        if len(compressed) < len(data):
+            path.with_name(path.name + '.br').write_bytes(compressed)
+
+
+def build_assets():
+    """Write fingerprinted copies of every asset and return the manifest,
+    mapping original URLs to fingerprinted URLs."""
+    manifest = {}
+
+    for directory in ASSET_DIRECTORIES:
+        for source in sorted((STATIC / directory).rglob('*')):
+            if not source.is_file():
+                continue
+
+            relative = source.relative_to(STATIC)
+            data = source.read_bytes()
+
+            target = DIST / hashed_name(relative, fingerprint(data))
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+            compress(target, data)
+
+            url = '/static/{}'.format(relative.as_posix())
+            manifest[url] = '/static/{}'.format(target.relative_to(STATIC).as_posix())
+            log.debug("{} -> {}", url, manifest[url])
+
+    with MANIFEST.open('w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def rewrite_template(manifest, name='index.html'):
+    """Rewrite references to static assets in the given template, writing the
+    result next to it as `<name>.dist.html`."""
+    source = TEMPLATES / name
+    target = source.with_suffix('.dist' + source.suffix)
+
+    def replace(match):
+        return manifest.get(match.group(0), match.group(0))
+
+    html = source.read_text()
+    html = re.sub(r'/static/[^"\'\s>]+', replace, html)
+    target.write_text(html)
+    return target
+
+
+def clean():
+    """Remove any previous build output."""
+    if DIST.exists():
+        for path in sorted(DIST.rglob('*'), reverse=True):
+            if path.is_dir():
+                path.rmdir()
+            else:
+                path.unlink()
+
+
+def built_template(name='index.html'):
+    """Return the name of the built template if it's newer than the original,
+    or `name` if it hasn't been built."""
+    source = TEMPLATES / name
+    target = source.with_suffix('.dist' + source.suffix)
+
+    try:
+        if target.stat().st_mtime >= source.stat().st_mtime:
+            return target.name
+    except FileNotFoundError:
+        pass
+    return name
+
+
+def main():
+    clean()
+    manifest = build_assets()
+    template = rewrite_template(manifest)
+    log.info("Built {} assets, wrote {}", len(manifest), template)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""Transports for aesop's events.
+
+Messages are published to channels, and subscribers receive every message
+published to the channels they've subscribed to. A subscription ending in
+`*` is a pattern, matching every channel starting with what comes before it.
+Subscribers receive (subscription, channel, message) tuples, where
+subscription is the channel or pattern that matched. There are two backends,
+chosen with the AESOP_EVENT_BACKEND environment variable:
+
+ - `unix`, the default, talks to a broker run by the events service
+   (`python -m aesop.events`) over a Unix domain socket. The events service
+   itself uses its broker directly.
+ - `redis`, which uses a redis server on localhost.
+"""
+
+import asyncio
+import os
+from collections import defaultdict
+
+from logbook import Logger
+
+log = Logger('aesop.bus')
+
+SOCKET_PATH = os.environ.get(
+    'AESOP_EVENT_SOCKET', os.path.expanduser('~/.config/aesop/events.sock'))
+
+RECONNECT_DELAY = 0.5
+
+# longest line the broker will accept, and the most a subscriber of the
+# broker may have waiting to be written to it before it's disconnected.
+MAX_LINE_SIZE = 2 ** 20
+MAX_SUBSCRIBER_BUFFER = 4 * 2 ** 20
+
+
+def encode_line(*parts):
+    return (' '.join(parts) + '\n').encode('utf8')
+
+
+def decode_line(line, parts):
+    return line.decode('utf8').rstrip('\n').split(' ', parts - 1)
+
+
+class Broker:
+    """Routes published messages to subscribers, both in this process and
+    connected over a Unix domain socket.
+
+    The socket protocol is line based. Clients send `PUB <channel> <message>`
+    to publish and `SUB <channel or pattern>` to subscribe, and the broker
+    sends subscribers `MSG <subscription> <channel> <message>`. Messages
+    must not contain newlines, which holds for anything encoded with
+    `json.dumps`.
+    """
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.patterns = defaultdict(set)
+
+    def publish(self, channel, message):
+        for callback in list(self.subscribers.get(channel, ())):
+            callback(channel, channel, message)
+
+        for pattern, callbacks in list(self.patterns.items()):
+            if channel.startswith(pattern[:-1]):
+                for callback in list(callbacks):
+                    callback(pattern, channel, message)
+
+    def subscribe(self, subscription, callback):
+        if is_pattern(subscription):
+            self.patterns[subscription].add(callback)
+        else:
+            self.subscribers[subscription].add(callback)
+
+    def unsubscribe(self, callback):
+        for subscriptions in (self.subscribers, self.patterns):
+            for key in list(subscriptions):
+                subscriptions[key].discard(callback)
+                if not subscriptions[key]:
+                    del subscriptions[key]
+
+    async def serve(self, path=SOCKET_PATH):
+        if os.path.exists(path):
+            os.unlink(path)
+
+        server = await asyncio.start_unix_server(
+            self._handle_client, path, limit=MAX_LINE_SIZE)
+        log.info("Event broker listening on {}", path)
+        return server
+
+    async def _handle_client(self, reader, writer):
+        def send(subscription, channel, message):
+            if writer.transport.get_write_buffer_size() > MAX_SUBSCRIBER_BUFFER:
+                log.warning("Subscriber is too far behind, disconnecting")
+                self.unsubscribe(send)
+                writer.close()
+                return
+            writer.write(encode_line('MSG', subscription, channel, message))
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                command, rest = decode_line(line, 2)
+
+                if command == 'PUB':
+                    channel, message = rest.split(' ', 1)
+                    self.publish(channel, message)
+                elif command == 'SUB':
+                    self.subscribe(rest, send)
+                else:
+                    log.warning("Unknown command {!r}", command)
+        except Exception:
+            log.exception("Error handling event broker client")
+        finally:
+            self.unsubscribe(send)
+            writer.close()
+
+
+def is_pattern(subscription):
+    return subscription.endswith('*')
+
+
+class LocalBackend:
+    """Use a broker in this process."""
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def publish(self, channel, message):
+        self.broker.publish(channel, message)
+
+    async def subscribe(self, channels):
+        return LocalSubscriber(self.broker, channels)
+
+    def close(self):
+        pass
+
+
+class LocalSubscriber:
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.queue = asyncio.Queue()
+
+        for channel in channels:
+            broker.subscribe(channel, self._received)
+
+    def _received(self, subscription, channel, message):
+        self.queue.put_nowait((subscription, channel, message))
+
+    async def subscribe(self, channels):
+        for channel in channels:
+            self.broker.subscribe(channel, self._received)
+
+    async def next_message(self):
+        """Return the next (subscription, channel, message) tuple."""
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self._received)
+
+
+class UnixBackend:
+    """Talk to the events service's broker over a Unix domain socket.
+
+    Publishing uses one connection per event loop, kept open for the life of
+    the process.
+    """
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        self._connections = {}
+
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+
+        if loop not in self._connections:
+            self._connections[loop] = asyncio.ensure_future(
+                asyncio.open_unix_connection(self.path))
+
+        try:
+            reader, writer = await asyncio.shield(self._connections[loop])
+        except Exception:
+            # don't cache failed connection attempts.
+            self._connections.pop(loop, None)
+            raise
+
+        if reader.at_eof():
+            # the broker went away, reconnect.
+            self._connections.pop(loop, None)
+            writer.close()
+            return await self._connection()
+        return writer
+
+    async def publish(self, channel, message):
+        line = encode_line('PUB', channel, message)
+
+        try:
+            writer = await self._connection()
+        except (ConnectionError, FileNotFoundError):
+            log.warning("Could not connect to the event broker, retrying")
+            await asyncio.sleep(RECONNECT_DELAY)
+            writer = await self._connection()
+
+        writer.write(line)
+        await writer.drain()
+
+    def close(self):
+        """Close the publishing connection for the current event loop."""
+        connection = self._connections.pop(asyncio.get_running_loop(), None)
+        if connection is not None and connection.done() and connection.exception() is None:
+            reader, writer = connection.result()
+            writer.close()
+
+    async def subscribe(self, channels):
+        reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_LINE_SIZE)
+        subscriber = UnixSubscriber(reader, writer)
+        await subscriber.subscribe(channels)
+        return subscriber
+
+
+class UnixSubscriber:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def subscribe(self, channels):
+        for channel in channels:
+            self.writer.write(encode_line('SUB', channel))
+        await self.writer.drain()
+
+    async def next_message(self):
+        """Return the next (subscription, channel, message) tuple."""
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError('Lost connection to the event broker')
+
+        _, subscription, channel, message = decode_line(line, 4)
+        return subscription, channel, message
+
+    def close(self):
+        self.writer.close()
+
+
+class RedisBackend:
+    """Use a redis server on localhost.
+
+    Publishing uses a connection pool per event loop, kept open for the life
+    of the process.
+    """
+    PUBLISH_POOL_SIZE = 2
+
+    def __init__(self, host='localhost', port=6379):
+        import asyncio_redis
+        self.redis = asyncio_redis
+        self.host = host
+        self.port = port
+        self._pools = {}
+
+    async def _pool(self):
+        loop = asyncio.get_running_loop()
+
+        if loop not in self._pools:
+            self._pools[loop] = asyncio.ensure_future(self.redis.Pool.create(
+                host=self.host, port=self.port, poolsize=self.PUBLISH_POOL_SIZE,
+                auto_reconnect=True))
+
+        try:
+            return await asyncio.shield(self._pools[loop])
+        except Exception:
+            # don't cache failed connection attempts.
+            self._pools.pop(loop, None)
+            raise
+
+    async def publish(self, channel, message):
+        pool = await self._pool()
+
+        try:
+            await pool.publish(channel, message)
+        except self.redis.NotConnectedError:
+            # the pool reconnects by itself, give it a moment and try once more.
+            log.warning("Not connected to redis, retrying publish to {}", channel)
+            await asyncio.sleep(RECONNECT_DELAY)
+            await pool.publish(channel, message)
+
+    def close(self):
+        """Close the publishing pool for the current event loop."""
+        pool = self._pools.pop(asyncio.get_running_loop(), None)
+        if pool is not None and pool.done() and pool.exception() is None:
+            pool.result().close()
+
+    async def subscribe(self, channels):
+        connection = await self.redis.Connection.create(host=self.host, port=self.port)
+        subscriber = RedisSubscriber(connection, await connection.start_subscribe())
+        await subscriber.subscribe(channels)
+        return subscriber
+
+
+class RedisSubscriber:
+    def __init__(self, connection, subscriber):
+        self.connection = connection
+        self.subscriber = subscriber
+
+    async def subscribe(self, channels):
+        patterns = [c for c in channels if is_pattern(c)]
+        channels = [c for c in channels if not is_pattern(c)]
+
+        if patterns:
+            await self.subscriber.psubscribe(patterns)
+        if channels:
+            await self.subscriber.subscribe(channels)
+
+    async def next_message(self):
+        """Return the next (subscription, channel, message) tuple."""
+        message = await self.subscriber.next_published()
+        return message.pattern or message.channel, message.channel, message.value
+
+    def close(self):
+        self.connection.close()
+
+
+backends = {
+    'unix': UnixBackend,
+    'redis': RedisBackend,
+}
+
+_backend = None
+
+
+def backend():
+    global _backend
+
+    if _backend is None:
+        name = os.environ.get('AESOP_EVENT_BACKEND', 'unix')
+        _backend = backends[name]()
+    return _backend
+
+
+def set_backend(new_backend):
+    global _backend
+    _backend = new_backend
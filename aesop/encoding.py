@@ -0,0 +1,89 @@
+"""Compact encodings for large lists of media.
+
+Rather than a list of objects repeating every key, a table is sent as its
+column names once, a dictionary of every genre, and a list of rows. Each row
+holds the values in column order, with genres as indexes into the genre
+dictionary:
+
+    {"columns": ["id", "title", ..., "genres"],
+     "genres": ["Action", "Comedy", ...],
+     "rows": [[1, "Alien", ..., [0, 4]], ...]}
+
+Rows are encoded as they come out of the database, so the whole list is never
+built in memory.
+"""
+
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON_MIMETYPE = 'application/json'
+TABLE_MIMETYPE = 'application/vnd.aesop.table+json'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+# amount of rows to encode before handing a chunk to the server.
+CHUNK_SIZE = 500
+
+
+def mimetypes():
+    """Return the supported mimetypes, plain JSON first so it remains the
+    default for clients that accept anything."""
+    available = [JSON_MIMETYPE, TABLE_MIMETYPE]
+    if msgpack is not None:
+        available.append(MSGPACK_MIMETYPE)
+    return available
+
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def json_table(columns, genres, rows):
+    """Yield the table as chunks of JSON."""
+    yield '{{"columns":{},"genres":{},"rows":['.format(
+        json.dumps(columns, separators=(',', ':')),
+        json.dumps(genres, separators=(',', ':')))
+
+    separator = ''
+    for chunk in _chunks(rows):
+        # dump the chunk as a list and strip the surrounding brackets.
+        yield separator + json.dumps(chunk, separators=(',', ':'))[1:-1]
+        separator = ','
+
+    yield ']}'
+
+
+def msgpack_table(columns, genres, rows, count):
+    """Yield the table as chunks of msgpack. msgpack needs the amount of rows
+    up front, so `count` must be the amount of rows `rows` will yield."""
+    packer = msgpack.Packer(use_bin_type=True)
+
+    yield packer.pack_map_header(3)
+    yield packer.pack('columns') + packer.pack(columns)
+    yield packer.pack('genres') + packer.pack(genres)
+    yield packer.pack('rows') + packer.pack_array_header(count)
+
+    for chunk in _chunks(rows):
+        yield b''.join(packer.pack(row) for row in chunk)
+
+
+def table(mimetype, columns, genres, rows, count):
+    """Return a generator encoding the table as `mimetype`. `count` is only
+    called if the encoding needs it."""
+    if mimetype == MSGPACK_MIMETYPE:
+        return msgpack_table(columns, genres, rows, count())
+    elif mimetype == TABLE_MIMETYPE:
+        return json_table(columns, genres, rows)
+
+    raise ValueError('Unsupported mimetype {}'.format(mimetype))
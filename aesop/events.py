@@ -1,162 +1,517 @@
+import argparse
 import asyncio
 import json
-from collections import namedtuple
+import threading
+import time
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs, urlparse
 
-import asyncio_redis
 import websockets
 from logbook import Logger
 
-from aesop.utils import setup_logging
+from aesop import bus, metrics
+from aesop.utils import Supervisor, setup_logging
 
 log = Logger('aesop.events')
 
 
+# each type of event is published to its own channel under EVENTS_CHANNEL, so
+# listeners only receive the types they're interested in.
 EVENTS_CHANNEL = 'aesop-events'
+ALL_EVENTS = EVENTS_CHANNEL + ':*'
+
+
+published = metrics.counter('aesop_events_published_total', 'Events published')
+publish_time = metrics.histogram(
+    'aesop_event_publish_seconds', 'Round trip time of publishing an event to the bus')
+received = metrics.counter('aesop_events_received_total', 'Events received from the bus')
+dropped = metrics.counter(
+    'aesop_events_dropped_total', 'Events dropped because a listener was too far behind')
+
+
+def channel(type):
+    return '{}:{}'.format(EVENTS_CHANNEL, type)
+
+
+def channels(event_types):
+    """Return the channels to subscribe to to receive `event_types`, or every
+    event if there are none. Shutdowns are always received."""
+    if not event_types:
+        return {ALL_EVENTS}
+    return {channel(type) for type in event_types} | {channel('shutdown')}
+
+
+_blocking_loop = None
+_blocking_lock = threading.Lock()
+
+
+def blocking_loop():
+    """Return the event loop `.blocking` calls run on, a single loop running
+    in a background thread so it's never mixed up with a caller's own."""
+    global _blocking_loop
+
+    with _blocking_lock:
+        if _blocking_loop is None:
+            _blocking_loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=_blocking_loop.run_forever, name='aesop-events', daemon=True)
+            thread.start()
+        return _blocking_loop
 
 
 def add_blocking(func):
     def blocking(*args, **kwargs):
-        try:
-            loop = asyncio.get_event_loop()
-        except Exception:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-        coro = func(*args, **kwargs)
-        return loop.run_until_complete(coro)
+        future = asyncio.run_coroutine_threadsafe(func(*args, **kwargs), blocking_loop())
+        return future.result()
     func.blocking = blocking
     return func
 
 
-@asyncio.coroutine
 @add_blocking
-def info(message):
-    return notify(message, level='info')
+async def info(message):
+    return await notify(message, level='info')
 
 
-@asyncio.coroutine
 @add_blocking
-def error(message):
-    return notify(message, level='error')
+async def error(message):
+    return await notify(message, level='error')
 
 
-@asyncio.coroutine
 @add_blocking
-def warning(message):
-    return notify(message, level='warning')
+async def warning(message):
+    return await notify(message, level='warning')
 
 
-@asyncio.coroutine
 @add_blocking
-def success(message):
-    return notify(message, level='success')
+async def success(message):
+    return await notify(message, level='success')
 
 
-@asyncio.coroutine
 @add_blocking
-def notify(message, **kwargs):
-    return broadcast(message=message, type='notification', **kwargs)
+async def notify(message, **kwargs):
+    return await broadcast(message=message, type='notification', **kwargs)
 
 
-@asyncio.coroutine
 @add_blocking
-def broadcast(type, **kwargs):
-    connection = yield from _get_connection()
-
+async def broadcast(type, **kwargs):
     kwargs['type'] = type
-    yield from connection.publish(EVENTS_CHANNEL, json.dumps(kwargs))
-
-    connection.close()
-
 
-@asyncio.coroutine
-def _get_connection():
-    connection = yield from asyncio_redis.Connection.create(host='localhost', port=6379)
-    return connection
+    with publish_time.time():
+        await bus.backend().publish(channel(type), json.dumps(kwargs))
+    published.inc()
 
 
 def listener(*events):
     ev = EventListener(events)
-    asyncio.async(ev.start())
+    _subscription.add(ev)
     return ev
 
 
+class Event:
+    """An event received from the bus.
+
+    The event's fields are available as attributes, and `raw` is the event
+    as it was encoded, so it can be passed on without encoding it again.
+    """
+    __slots__ = ('type', 'private', 'raw', '_fields')
+
+    def __init__(self, fields, raw=None):
+        self.type = fields['type']
+        self.private = fields.get('private', False)
+        self.raw = raw if raw is not None else json.dumps(fields)
+        self._fields = fields
+
+    def __getattr__(self, attr):
+        try:
+            return self._fields[attr]
+        except KeyError:
+            raise AttributeError(attr) from None
+
+    def __repr__(self):
+        return 'Event({!r})'.format(self._fields)
+
+    def _asdict(self):
+        return dict(self._fields, private=self.private)
+
+
+def decode(value):
+    return Event(json.loads(value), value)
+
+
+class Subscription:
+    """A single subscription shared by every listener in the process.
+
+    Each event is decoded once and handed to every registered listener, so
+    having many listeners doesn't mean many connections. The subscription
+    covers the channels of every event type a listener has asked for.
+
+    `channels` are the channels wanted, and `subscribed` the ones the
+    current subscriber has confirmed.
+    """
+    def __init__(self):
+        self.listeners = set()
+        self.channels = set()
+        self.subscribed = set()
+        self.subscriber = None
+        self.task = None
+        self.subscribing = set()
+
+    def add(self, listener):
+        self.listeners.add(listener)
+
+        new_channels = channels(listener.event_types) - self.channels
+        self.channels |= new_channels
+
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._runner())
+        elif new_channels and self.subscriber is not None:
+            task = asyncio.ensure_future(self._add_channels(self.subscriber, new_channels))
+            self.subscribing.add(task)
+            task.add_done_callback(self.subscribing.discard)
+
+    def remove(self, listener):
+        self.listeners.discard(listener)
+
+    async def close(self):
+        tasks = list(self.subscribing)
+        if self.task is not None:
+            tasks.append(self.task)
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _add_channels(self, subscriber, new_channels):
+        """Add channels to a running subscriber, starting the subscription
+        over with every channel if that fails."""
+        try:
+            await subscriber.subscribe(sorted(new_channels))
+        except Exception:
+            log.exception("Couldn't subscribe to {}, resubscribing", sorted(new_channels))
+            if subscriber is self.subscriber:
+                self._resubscribe()
+        else:
+            if subscriber is self.subscriber:
+                self.subscribed |= new_channels
+
+    def _resubscribe(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.task = asyncio.ensure_future(self._runner(delay=bus.RECONNECT_DELAY))
+
+    async def _runner(self, delay=0):
+        try:
+            await asyncio.sleep(delay)
+
+            while True:
+                try:
+                    await self._subscribe()
+                except Exception:
+                    log.exception("Lost subscription, resubscribing")
+                    await asyncio.sleep(bus.RECONNECT_DELAY)
+                else:
+                    break
+        finally:
+            # a failed _add_channels may have started another runner already.
+            if self.task is asyncio.current_task():
+                self.task = None
+
+    async def _subscribe(self):
+        subscribed = set(self.channels)
+        subscriber = await bus.backend().subscribe(sorted(subscribed))
+        self.subscriber = subscriber
+        self.subscribed = subscribed
+
+        try:
+            # listeners may have been added while subscribing.
+            missing = self.channels - subscribed
+            if missing:
+                await subscriber.subscribe(sorted(missing))
+                self.subscribed |= missing
+
+            while True:
+                subscription, channel, message = await subscriber.next_message()
+
+                if ALL_EVENTS in self.subscribed and subscription != ALL_EVENTS:
+                    # this will also be received through ALL_EVENTS.
+                    continue
+
+                received.inc()
+                event = decode(message)
+
+                if event.type == 'shutdown':
+                    event = None
+
+                for listener in list(self.listeners):
+                    listener.put(event)
+
+                if event is None:
+                    return
+        finally:
+            if self.subscriber is subscriber:
+                self.subscriber = None
+                self.subscribed = set()
+            subscriber.close()
+
+
+_subscription = Subscription()
+
+
+async def close():
+    """Stop receiving events, and close this event loop's connection to the
+    bus. Called by services as they shut down."""
+    await _subscription.close()
+    bus.backend().close()
+
+# amount of undelivered events a listener can have before new ones are
+# dropped.
+LISTENER_QUEUE_SIZE = 256
+
+
 class EventListener:
-    def __init__(self, event_types):
+    def __init__(self, event_types, maxsize=LISTENER_QUEUE_SIZE):
         self.event_types = event_types
-        self.waiter = None
+        self.queue = asyncio.Queue(maxsize)
 
-    @asyncio.coroutine
-    def start(self):
-        self.connection = yield from _get_connection()
-        self._subscriber = yield from self.connection.start_subscribe()
-
-        yield from self._subscriber.subscribe([EVENTS_CHANNEL])
+    def put(self, event):
+        if event is None:
+            # make sure the listener finds out about shutdowns.
+            while self.queue.full():
+                self.queue.get_nowait()
+        elif self.event_types and event.type not in self.event_types:
+            return
 
-        yield from self._runner()
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            dropped.inc()
+            log.warning("Listener is too far behind, dropping {!r}", event)
 
-    @asyncio.coroutine
-    def _runner(self):
-        while True:
-            event = yield from self._subscriber.next_published()
-            event = json.loads(event.value)
-            attrs = sorted(set(list(event.keys()) + ['private', 'type']))
-            event.setdefault('private', False)
-            event = namedtuple('Event', attrs)(**event)
-
-            if self.event_types and event.type not in self.event_types:
-                continue
-
-            if event.type == 'shutdown':
-                self.connection.close()
-                event = None
-
-            if self.waiter is not None:
-                self.waiter.set_result(event)
-                self.waiter = None
-
-    @asyncio.coroutine
-    def wait(self):
-        if self.waiter is not None:
-            raise ValueError("Only one waiter at a time")
-        self.waiter = asyncio.Future()
-        return self.waiter
+    async def wait(self):
+        return await self.queue.get()
 
     def close(self):
-        self.connection.close()
+        _subscription.remove(self)
 
 
-@asyncio.coroutine
-def server(websocket, path):
-    client = ':'.join(map(str, websocket.writer.get_extra_info('peername')))
-    log.info("New client {}", client)
+class ClientTooSlow(Exception):
+    pass
 
-    yield from broadcast('new-client', private=True)
 
-    _listener = listener()
+# a websocket client with more than this many events waiting to be sent is
+# considered too far behind and disconnected.
+CLIENT_MAX_BACKLOG = 512
 
-    while True:
-        event = yield from _listener.wait()
+# seconds a single send to a websocket client may take before the client is
+# disconnected.
+CLIENT_SEND_TIMEOUT = 10
+
+
+# seconds to wait for more player changes before sending them to a client.
+PLAYER_STATE_WINDOW = 0.05
+
+
+class ClientListener(EventListener):
+    """Listener for a websocket client, which may be arbitrarily slow.
+
+    Player attribute updates aren't sent individually. Changes that arrive
+    within PLAYER_STATE_WINDOW of each other are sent together as a single
+    `player-state` event, holding only the attributes whose values differ
+    from what the client was last sent. Everything else is kept in order and
+    never dropped. If more than `max_backlog` events are waiting, the client
+    is too far behind and `wait()` raises ClientTooSlow.
+    """
+    def __init__(self, event_types=(), max_backlog=None):
+        self.event_types = event_types
+        self.max_backlog = max_backlog or CLIENT_MAX_BACKLOG
+        self.pending = deque()
+        self.player_changes = OrderedDict()
+        self.player_state = {}
+        self.ready = asyncio.Event()
+        self.too_slow = False
+
+    def put(self, event):
         if event is None:
-            break
-        if event.private:
-            continue
+            self.pending.append(None)
+        elif event.private or (self.event_types and event.type not in self.event_types):
+            return
+        elif event.type == 'player':
+            self.player_changes[event.attribute] = event.value
+        else:
+            self.pending.append(event)
 
-        log.info("{} <- {!r}", client, event)
+        if len(self.pending) > self.max_backlog:
+            self.too_slow = True
+        self.ready.set()
 
-        try:
-            yield from websocket.send(json.dumps(event._asdict()))
-        except websockets.InvalidState:
-            _listener.close()
+    async def wait(self):
+        while True:
+            while not self.pending and not self.player_changes:
+                self.ready.clear()
+                await self.ready.wait()
+
+            if self.too_slow:
+                raise ClientTooSlow('{} events waiting'.format(len(self.pending)))
+
+            if self.pending:
+                return self.pending.popleft()
+
+            # give related changes a chance to arrive, so they're sent together.
+            await asyncio.sleep(PLAYER_STATE_WINDOW)
+
+            changes = {
+                attribute: value
+                for (attribute, value) in self.player_changes.items()
+                if attribute not in self.player_state or self.player_state[attribute] != value
+            }
+            self.player_changes.clear()
+
+            if changes:
+                self.player_state.update(changes)
+                return Event({'type': 'player-state', 'changes': changes})
+
+
+# how many recent notifications are kept, and for how many seconds, to show
+# to newly connected clients.
+REPLAY_NOTIFICATIONS = 10
+REPLAY_NOTIFICATION_AGE = 30
+
+
+class StateCache:
+    """Keeps the latest value of every player attribute, and the most recent
+    notifications, so new clients can be brought up to date without asking
+    the player to broadcast everything again."""
+    event_types = ('player', 'notification')
+
+    def __init__(self):
+        self.player = OrderedDict()
+        self.notifications = deque(maxlen=REPLAY_NOTIFICATIONS)
+
+    def put(self, event):
+        if event is None:
             return
+        elif event.type == 'player':
+            self.player[event.attribute] = event
+        elif event.type == 'notification':
+            self.notifications.append((time.monotonic(), event))
+
+    def snapshot(self):
+        """Return the events a new client needs to catch up."""
+        oldest = time.monotonic() - REPLAY_NOTIFICATION_AGE
+        events = list(self.player.values())
+        events.extend(event for (received, event) in self.notifications if received >= oldest)
+        return events
+
+
+_state = StateCache()
+
+
+def _clients():
+    return [listener for listener in _subscription.listeners if isinstance(listener, ClientListener)]
+
+
+metrics.gauge(
+    'aesop_websocket_clients', 'Connected websocket clients',
+    lambda: len(_clients()))
+metrics.gauge(
+    'aesop_websocket_client_backlog', 'Events waiting to be sent to the furthest behind client',
+    lambda: max((len(c.pending) + len(c.player_changes) for c in _clients()), default=0))
+metrics.gauge(
+    'aesop_websocket_client_backlog_total', 'Events waiting to be sent to all clients',
+    lambda: sum(len(c.pending) + len(c.player_changes) for c in _clients()))
+send_time = metrics.histogram(
+    'aesop_websocket_send_seconds', 'Time taken to send an event to a websocket client')
+slow_clients = metrics.counter(
+    'aesop_websocket_slow_disconnects_total', 'Websocket clients disconnected for being too far behind')
+
+
+async def server(websocket):
+    client = ':'.join(map(str, websocket.remote_address))
+
+    # clients can choose what they're sent with e.g. ?topics=player,notification
+    topics = parse_qs(urlparse(websocket.request.path).query).get('topics', [''])[0]
+    event_types = tuple(topic for topic in topics.split(',') if topic)
+    log.info("New client {}, topics {}", client, event_types or 'all')
+
+    _listener = ClientListener(event_types)
+    for event in _state.snapshot():
+        _listener.put(event)
+    _subscription.add(_listener)
+
+    # stop waiting for events as soon as the client goes away, rather than
+    # finding out on the next send.
+    closed = asyncio.ensure_future(websocket.wait_closed())
+    closed.add_done_callback(lambda _: _listener.put(None))
+
+    try:
+        if not _state.player:
+            # nothing's known about the player yet, ask for everything.
+            await broadcast('new-client', private=True)
+
+        while True:
+            event = await _listener.wait()
+            if event is None:
+                break
+
+            log.info("{} <- {!r}", client, event)
+
+            with send_time.time():
+                await asyncio.wait_for(websocket.send(event.raw), CLIENT_SEND_TIMEOUT)
+    except (ClientTooSlow, asyncio.TimeoutError) as e:
+        slow_clients.inc()
+        log.warning("Disconnecting {}, it's too far behind: {!r}", client, e)
+        await websocket.close()
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        closed.cancel()
+        _listener.close()
 
 
 def main():
+    global CLIENT_MAX_BACKLOG, CLIENT_SEND_TIMEOUT
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--max-backlog', type=int, default=CLIENT_MAX_BACKLOG,
+        help="Disconnect websocket clients with more than this many events waiting")
+    parser.add_argument(
+        '--send-timeout', type=float, default=CLIENT_SEND_TIMEOUT,
+        help="Disconnect websocket clients that take longer than this many seconds to receive an event")
+    parser.add_argument(
+        '--metrics-port', type=int, default=metrics.EVENTS_PORT,
+        help="Port to serve metrics on")
+    options = parser.parse_args()
+
+    CLIENT_MAX_BACKLOG = options.max_backlog
+    CLIENT_SEND_TIMEOUT = options.send_timeout
+
     setup_logging('aesop.events', 'INFO')
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(websockets.serve(server, '0.0.0.0', 5001))
+    asyncio.run(run(options))
+
+
+async def run(options):
+    supervisor = Supervisor()
+    servers = []
+
+    if isinstance(bus.backend(), bus.UnixBackend):
+        broker = bus.Broker()
+        bus.set_backend(bus.LocalBackend(broker))
+        servers.append(await broker.serve())
+
+    _subscription.add(_state)
+    servers.append(await metrics.start(supervisor, options.metrics_port))
+    servers.append(await websockets.serve(server, '0.0.0.0', 5001))
     log.info("Client event server started on port 5001")
-    loop.run_forever()
+
+    try:
+        await supervisor.wait()
+    finally:
+        log.info("Shutting down")
+        for running in servers:
+            running.close()
+        await asyncio.gather(*[running.wait_closed() for running in servers])
+        await close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,209 @@
+"""Runtime metrics for aesop's services, in Prometheus' text format.
+
+Metrics are registered once, at import time, with `counter()`, `gauge()` or
+`histogram()`, and updated as the service runs. Services running an event
+loop call `start(supervisor, port)` to sample event loop lag and serve their
+metrics at http://127.0.0.1:<port>/metrics.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+
+from logbook import Logger
+
+log = Logger('aesop.metrics')
+
+# ports each service serves its metrics on.
+EVENTS_PORT = 9101
+PLAYER_PORT = 9102
+SUBTITLES_PORT = 9103
+UI_PORT = 9104
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+registry = OrderedDict()
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, '', self.value
+
+
+class Gauge:
+    """A value that can go up and down. If `function` is given, it's called
+    to get the value whenever the metrics are collected."""
+    type = 'gauge'
+
+    def __init__(self, name, help, function=None):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self):
+        value = self.function() if self.function is not None else self.value
+        yield self.name, '', value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def time(self):
+        """Return a context manager observing how long its body takes."""
+        return Timer(self)
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield self.name + '_bucket', '{{le="{}"}}'.format(bound), cumulative
+        yield self.name + '_bucket', '{le="+Inf"}', self.count
+        yield self.name + '_sum', '', self.sum
+        yield self.name + '_count', '', self.count
+
+
+class Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.monotonic() - self.start)
+
+
+def _register(cls, name, *args, **kwargs):
+    if name not in registry:
+        registry[name] = cls(name, *args, **kwargs)
+    return registry[name]
+
+
+def counter(name, help):
+    return _register(Counter, name, help)
+
+
+def gauge(name, help, function=None):
+    return _register(Gauge, name, help, function=function)
+
+
+def histogram(name, help, buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, help, buckets=buckets)
+
+
+def render():
+    """Return every registered metric in Prometheus' text format."""
+    lines = []
+
+    for metric in registry.values():
+        lines.append('# HELP {} {}'.format(metric.name, metric.help))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+
+        try:
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels, float(value)))
+        except Exception:
+            log.exception("Error collecting {}", metric.name)
+
+    return '\n'.join(lines) + '\n'
+
+
+loop_lag = histogram(
+    'aesop_event_loop_lag_seconds',
+    'How late the event loop was in running a scheduled callback')
+
+# how often to check the event loop's lag, in seconds.
+LAG_INTERVAL = 0.5
+
+
+async def monitor_loop(interval=LAG_INTERVAL):
+    """Sample how far behind the event loop is running, forever."""
+    loop = asyncio.get_running_loop()
+
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        loop_lag.observe(max(0.0, loop.time() - expected))
+
+
+async def _handle_request(reader, writer):
+    try:
+        request = await reader.readline()
+
+        # headers aren't needed.
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+        parts = request.decode('latin1').split()
+
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', render().encode('utf8')
+        else:
+            status, body = '404 Not Found', b'Not Found\n'
+
+        writer.write((
+            'HTTP/1.0 {}\r\n'
+            'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            'Content-Length: {}\r\n'
+            '\r\n'
+        ).format(status, len(body)).encode('latin1') + body)
+        await writer.drain()
+    except Exception:
+        log.exception("Error serving metrics")
+    finally:
+        writer.close()
+
+
+async def serve(port, host='127.0.0.1'):
+    """Serve metrics on the given port, returning the server."""
+    server = await asyncio.start_server(_handle_request, host, port)
+    log.info("Serving metrics on {}:{}", host, port)
+    return server
+
+
+async def start(supervisor, port, host='127.0.0.1'):
+    """Serve metrics on the given port and start sampling event loop lag.
+    Returns the server, for the caller to close on shutdown."""
+    server = await serve(port, host)
+    supervisor.spawn(monitor_loop)
+    return server
@@ -1,8 +1,9 @@
 import os
+from collections import defaultdict
 
 from peewee import (
     Model, CharField, ForeignKeyField, IntegerField, Proxy, SqliteDatabase,
-    BooleanField, IntegrityError, CompositeKey
+    BooleanField, IntegrityError, CompositeKey, fn
 )
 
 database_proxy = Proxy()
@@ -48,9 +49,12 @@ class Config(BaseModel):
             ('player', 'preferred audio', 'eng'),
             ('player', 'preferred subtitle', 'eng'),
             ('player', 'seek size', '15'),
+            ('player', 'progress interval', '1'),
             ('processor', 'concurrency', '50'),
             ('processor', 'video types', 'avi, mp4, mkv, ogm'),
             ('player', 'subtitles for matching audio', '0'),
+            ('player', 'play unwatched only', '0'),
+            ('player', 'resume interval', '30'),
         ]
         for section, key, value in defaults:
             cls.create(section=section, key=key, value=value)
@@ -97,7 +101,7 @@ def GenreMixin(join_class):
 class Movie(BaseModel, GenreMixin(join_class='MovieGenre')):
     media_id = CharField(unique=True)
     title = CharField()
-    path = CharField()
+    path = CharField(index=True)
     year = IntegerField(null=True)
     watched = BooleanField(default=False)
 
@@ -109,6 +113,24 @@ class TVShow(BaseModel, GenreMixin(join_class='TVShowGenre')):
     type = CharField()  # anime or tv
     watched = BooleanField(default=False)
 
+    @classmethod
+    def update_watched(cls, show_ids):
+        """Recompute `watched` for the given shows, which are watched if all
+        of their episodes are watched. `show_ids` may be a list of ids or a
+        subquery selecting them."""
+        query = TVShowEpisode.select(
+            TVShowEpisode.show, fn.MIN(TVShowEpisode.watched)
+        ).where(
+            TVShowEpisode.show << show_ids
+        ).group_by(TVShowEpisode.show)
+
+        shows = defaultdict(list)
+        for show_id, watched in query.tuples():
+            shows[bool(watched)].append(show_id)
+
+        for watched, ids in shows.items():
+            cls.update(watched=watched).where(cls.id << ids, cls.watched != watched).execute()
+
 
 class MovieGenre(BaseModel):
     genre = ForeignKeyField(Genre)
@@ -129,7 +151,7 @@ class TVShowGenre(BaseModel):
 class TVShowEpisode(BaseModel):
     season = IntegerField(null=True)
     episode = IntegerField()
-    path = CharField()
+    path = CharField(index=True)
     watched = BooleanField(default=False)
 
     show = ForeignKeyField(TVShow, related_name='episodes')
@@ -141,6 +163,76 @@ class TVShowEpisode(BaseModel):
         return title
 
 
+class ResumePoint(BaseModel):
+    """Where playback of a video was up to, in seconds, so it can carry on
+    from there next time."""
+    path = CharField(primary_key=True)
+    position = IntegerField()
+
+    @classmethod
+    def position_for(cls, path):
+        try:
+            return cls.select(cls.position).where(cls.path == path).get().position
+        except cls.DoesNotExist:
+            return None
+
+    @classmethod
+    def save_positions(cls, positions):
+        """Save a dictionary of paths to positions in one transaction. Paths
+        with a position of None have their resume point removed."""
+        rows = [
+            dict(path=path, position=position)
+            for (path, position) in positions.items() if position is not None
+        ]
+
+        with database_proxy.transaction():
+            cls.delete().where(cls.path << list(positions)).execute()
+            if rows:
+                cls.insert_many(rows).execute()
+
+
+class Statistic(BaseModel):
+    """Library counters, kept up to date by anything that adds, removes or
+    changes the watched state of videos, so reading them doesn't need to
+    scan the library."""
+    name = CharField(primary_key=True)
+    value = IntegerField(default=0)
+
+    @classmethod
+    def adjust(cls, name, delta):
+        if delta:
+            cls.update(value=cls.value + delta).where(cls.name == name).execute()
+
+    @classmethod
+    def all(cls):
+        stats = dict(cls.select(cls.name, cls.value).tuples())
+
+        if set(stats) != set(statistic_queries):
+            stats = cls.rebuild()
+        return stats
+
+    @classmethod
+    def rebuild(cls):
+        """Recount everything from scratch. The counts are taken in the same
+        transaction as they're stored, so a change made in between isn't
+        lost."""
+        with database_proxy.transaction():
+            stats = {name: query().count() for (name, query) in statistic_queries.items()}
+            cls.delete().execute()
+            for name, value in stats.items():
+                cls.create(name=name, value=value)
+        return stats
+
+
+statistic_queries = {
+    'series': lambda: TVShow.select(),
+    'episodes': lambda: TVShowEpisode.select(),
+    'episodes watched': lambda: TVShowEpisode.select().where(TVShowEpisode.watched == True),
+    'movies': lambda: Movie.select(),
+    'movies watched': lambda: Movie.select().where(Movie.watched == True),
+}
+
+
 def init():
     path = os.path.expanduser('~/.config/aesop/database.db')
 
@@ -1,198 +1,24 @@
 #!/usr/bin/python
 
+import ctypes.util
+import itertools
 import os
+import sys
+from collections import namedtuple
 from enum import Enum
 
 from cffi import FFI
 
-ffi = FFI()
-
-
-definitions = """
-unsigned long mpv_client_api_version(void);
-typedef struct mpv_handle mpv_handle;
-typedef enum mpv_error {
-    MPV_ERROR_SUCCESS = 0,
-    MPV_ERROR_EVENT_QUEUE_FULL = -1,
-    MPV_ERROR_NOMEM = -2,
-    MPV_ERROR_UNINITIALIZED = -3,
-    MPV_ERROR_INVALID_PARAMETER = -4,
-    MPV_ERROR_OPTION_NOT_FOUND = -5,
-    MPV_ERROR_OPTION_FORMAT = -6,
-    MPV_ERROR_OPTION_ERROR = -7,
-    MPV_ERROR_PROPERTY_NOT_FOUND = -8,
-    MPV_ERROR_PROPERTY_FORMAT = -9,
-    MPV_ERROR_PROPERTY_UNAVAILABLE = -10,
-    MPV_ERROR_PROPERTY_ERROR = -11,
-    MPV_ERROR_COMMAND = -12,
-    MPV_ERROR_LOADING_FAILED = -13,
-    MPV_ERROR_AO_INIT_FAILED = -14,
-    MPV_ERROR_VO_INIT_FAILED = -15,
-    MPV_ERROR_NOTHING_TO_PLAY = -16,
-    MPV_ERROR_UNKNOWN_FORMAT = -17,
-    MPV_ERROR_UNSUPPORTED = -18,
-    MPV_ERROR_NOT_IMPLEMENTED = -19
-} mpv_error;
-const char *mpv_error_string(int error);
-void mpv_free(void *data);
-const char *mpv_client_name(mpv_handle *ctx);
-mpv_handle *mpv_create(void);
-int mpv_initialize(mpv_handle *ctx);
-void mpv_detach_destroy(mpv_handle *ctx);
-void mpv_terminate_destroy(mpv_handle *ctx);
-mpv_handle *mpv_create_client(mpv_handle *ctx, const char *name);
-int mpv_load_config_file(mpv_handle *ctx, const char *filename);
-void mpv_suspend(mpv_handle *ctx);
-void mpv_resume(mpv_handle *ctx);
-int64_t mpv_get_time_us(mpv_handle *ctx);
-typedef enum mpv_format {
-    MPV_FORMAT_NONE = 0,
-    MPV_FORMAT_STRING = 1,
-    MPV_FORMAT_OSD_STRING = 2,
-    MPV_FORMAT_FLAG = 3,
-    MPV_FORMAT_INT64 = 4,
-    MPV_FORMAT_DOUBLE = 5,
-    MPV_FORMAT_NODE = 6,
-    MPV_FORMAT_NODE_ARRAY = 7,
-    MPV_FORMAT_NODE_MAP = 8,
-    MPV_FORMAT_BYTE_ARRAY = 9
-} mpv_format;
-typedef struct mpv_node {
-    union {
-        char *string;
-        int flag;
-        int64_t int64;
-        double double_;
-        struct mpv_node_list *list;
-        struct mpv_byte_array *ba;
-    } u;
-    mpv_format format;
-} mpv_node;
-typedef struct mpv_node_list {
-    int num;
-    mpv_node *values;
-    char **keys;
-} mpv_node_list;
-typedef struct mpv_byte_array {
-    void *data;
-    size_t size;
-} mpv_byte_array;
-void mpv_free_node_contents(mpv_node *node);
-int mpv_set_option(mpv_handle *ctx, const char *name, mpv_format format,
-                   void *data);
-int mpv_set_option_string(mpv_handle *ctx, const char *name, const char *data);
-int mpv_command(mpv_handle *ctx, const char **args);
-int mpv_command_node(mpv_handle *ctx, mpv_node *args, mpv_node *result);
-int mpv_command_string(mpv_handle *ctx, const char *args);
-int mpv_command_async(mpv_handle *ctx, uint64_t reply_userdata,
-                      const char **args);
-int mpv_command_node_async(mpv_handle *ctx, uint64_t reply_userdata,
-                           mpv_node *args);
-int mpv_set_property(mpv_handle *ctx, const char *name, mpv_format format,
-                     void *data);
-int mpv_set_property_string(mpv_handle *ctx, const char *name, const char *data);
-int mpv_set_property_async(mpv_handle *ctx, uint64_t reply_userdata,
-                           const char *name, mpv_format format, void *data);
-int mpv_get_property(mpv_handle *ctx, const char *name, mpv_format format,
-                     void *data);
-char *mpv_get_property_string(mpv_handle *ctx, const char *name);
-char *mpv_get_property_osd_string(mpv_handle *ctx, const char *name);
-int mpv_get_property_async(mpv_handle *ctx, uint64_t reply_userdata,
-                           const char *name, mpv_format format);
-int mpv_observe_property(mpv_handle *mpv, uint64_t reply_userdata,
-                         const char *name, mpv_format format);
-int mpv_unobserve_property(mpv_handle *mpv, uint64_t registered_reply_userdata);
-typedef enum mpv_event_id {
-    MPV_EVENT_NONE = 0,
-    MPV_EVENT_SHUTDOWN = 1,
-    MPV_EVENT_LOG_MESSAGE = 2,
-    MPV_EVENT_GET_PROPERTY_REPLY = 3,
-    MPV_EVENT_SET_PROPERTY_REPLY = 4,
-    MPV_EVENT_COMMAND_REPLY = 5,
-    MPV_EVENT_START_FILE = 6,
-    MPV_EVENT_END_FILE = 7,
-    MPV_EVENT_FILE_LOADED = 8,
-    MPV_EVENT_TRACKS_CHANGED = 9,
-    MPV_EVENT_TRACK_SWITCHED = 10,
-    MPV_EVENT_IDLE = 11,
-    MPV_EVENT_PAUSE = 12,
-    MPV_EVENT_UNPAUSE = 13,
-    MPV_EVENT_TICK = 14,
-    MPV_EVENT_SCRIPT_INPUT_DISPATCH = 15,
-    MPV_EVENT_CLIENT_MESSAGE = 16,
-    MPV_EVENT_VIDEO_RECONFIG = 17,
-    MPV_EVENT_AUDIO_RECONFIG = 18,
-    MPV_EVENT_METADATA_UPDATE = 19,
-    MPV_EVENT_SEEK = 20,
-    MPV_EVENT_PLAYBACK_RESTART = 21,
-    MPV_EVENT_PROPERTY_CHANGE = 22,
-    MPV_EVENT_CHAPTER_CHANGE = 23,
-    MPV_EVENT_QUEUE_OVERFLOW = 24
-} mpv_event_id;
-const char *mpv_event_name(mpv_event_id event);
-typedef struct mpv_event_property {
-    const char *name;
-    mpv_format format;
-    void *data;
-} mpv_event_property;
-typedef enum mpv_log_level {
-    MPV_LOG_LEVEL_NONE = 0,
-    MPV_LOG_LEVEL_FATAL = 10,
-    MPV_LOG_LEVEL_ERROR = 20,
-    MPV_LOG_LEVEL_WARN = 30,
-    MPV_LOG_LEVEL_INFO = 40,
-    MPV_LOG_LEVEL_V = 50,
-    MPV_LOG_LEVEL_DEBUG = 60,
-    MPV_LOG_LEVEL_TRACE = 70,
-} mpv_log_level;
-typedef struct mpv_event_log_message {
-    const char *prefix;
-    const char *level;
-    const char *text;
-    mpv_log_level log_level;
-} mpv_event_log_message;
-typedef enum mpv_end_file_reason {
-    MPV_END_FILE_REASON_EOF = 0,
-    MPV_END_FILE_REASON_STOP = 2,
-    MPV_END_FILE_REASON_QUIT = 3,
-    MPV_END_FILE_REASON_ERROR = 4,
-} mpv_end_file_reason;
-typedef struct mpv_event_end_file {
-    int reason;
-    int error;
-} mpv_event_end_file;
-typedef struct mpv_event_script_input_dispatch {
-    int arg0;
-    const char *type;
-} mpv_event_script_input_dispatch;
-typedef struct mpv_event_client_message {
-    int num_args;
-    const char **args;
-} mpv_event_client_message;
-typedef struct mpv_event {
-    mpv_event_id event_id;
-    int error;
-    uint64_t reply_userdata;
-    void *data;
-} mpv_event;
-int mpv_request_event(mpv_handle *ctx, mpv_event_id event, int enable);
-int mpv_request_log_messages(mpv_handle *ctx, const char *min_level);
-mpv_event *mpv_wait_event(mpv_handle *ctx, double timeout);
-void mpv_wakeup(mpv_handle *ctx);
-void mpv_set_wakeup_callback(mpv_handle *ctx, void (*cb)(void *d), void *d);
-int mpv_get_wakeup_pipe(mpv_handle *ctx);
-void mpv_wait_async_requests(mpv_handle *ctx);
-typedef enum mpv_sub_api {
-    MPV_SUB_API_OPENGL_CB = 1
-} mpv_sub_api;
-void *mpv_get_sub_api(mpv_handle *ctx, mpv_sub_api sub_api);
-
-"""
-
-
-ffi.cdef(definitions)
-
-libmpv = ffi.verify('#include <mpv/client.h>', libraries=['mpv'])
+try:
+    from aesop._mpv import ffi, lib as libmpv
+except ImportError:
+    # the extension hasn't been built, so fall back to ABI mode, which needs
+    # no compiler but is slower to call into.
+    from aesop._mpv_build import definitions
+
+    ffi = FFI()
+    ffi.cdef(definitions)
+    libmpv = ffi.dlopen(ctypes.util.find_library('mpv') or 'libmpv.so')
 
 
 def client(**kwargs):
@@ -218,6 +44,33 @@ def command(client, *args):
         raise Exception(ffi.string(s))
 
 
+def command_node(client, *args):
+    """Run a command with arguments of any type, returning its result."""
+    node, keepalive = encode_node(list(args))
+    result = ffi.new('mpv_node *')
+
+    r = libmpv.mpv_command_node(client, node, result)
+    if r != 0:
+        s = libmpv.mpv_error_string(r)
+        raise Exception(ffi.string(s))
+
+    try:
+        return decode_node(result[0])
+    finally:
+        libmpv.mpv_free_node_contents(result)
+
+
+def command_async(client, reply_userdata, *args):
+    """Start running a command. An MPV_EVENT_COMMAND_REPLY event with the
+    given reply_userdata is sent when it has finished."""
+    r = libmpv.mpv_command_async(
+        client, reply_userdata, [ffi.new('char[]', _get_bytes(a)) for a in args] + [ffi.NULL])
+
+    if r != 0:
+        s = libmpv.mpv_error_string(r)
+        raise Exception(ffi.string(s))
+
+
 def set_option(client, name, type, value):
     if type == Format.String:
         return set_option_string(client, name, value)
@@ -248,8 +101,11 @@ def set_option_string(client, name, value):
 def set_property(client, name, type, value):
     if type == Format.String:
         return set_property_string(client, name, value)
-
-    value, format = _get_value(type, value)
+    elif type == Format.Node:
+        value, keepalive = encode_node(value)
+        format = libmpv.MPV_FORMAT_NODE
+    else:
+        value, format = _get_value(type, value)
 
     r = libmpv.mpv_set_property(client, _get_bytes(name), format, value)
     if r != 0:
@@ -273,8 +129,35 @@ def set_property_string(client, name, value):
             raise ValueError('{}: {}'.format(ffi.string(s), name))
 
 
+def set_property_async(client, reply_userdata, name, type, value):
+    """Start setting a property. An MPV_EVENT_SET_PROPERTY_REPLY event with
+    the given reply_userdata is sent when it has been set. The value is copied
+    by mpv, so doesn't need to be kept alive."""
+    if type == Format.String:
+        string = ffi.new('char[]', _get_bytes(value))
+        value, format = ffi.new('char **', string), libmpv.MPV_FORMAT_STRING
+    elif type == Format.Node:
+        value, keepalive = encode_node(value)
+        format = libmpv.MPV_FORMAT_NODE
+    else:
+        value, format = _get_value(type, value)
+
+    r = libmpv.mpv_set_property_async(client, reply_userdata, _get_bytes(name), format, value)
+    if r != 0:
+        raise ValueError('{}: {}'.format(ffi.string(libmpv.mpv_error_string(r)), name))
+
+
+def get_property_async(client, reply_userdata, name, type):
+    """Start getting a property. An MPV_EVENT_GET_PROPERTY_REPLY event with
+    the given reply_userdata and the value is sent when it has been read."""
+    r = libmpv.mpv_get_property_async(client, reply_userdata, _get_bytes(name), _get_format(type))
+    if r != 0:
+        raise ValueError('{}: {}'.format(ffi.string(libmpv.mpv_error_string(r)), name))
+
+
 def get_property(client, name, type):
-    """Return a given property of the client, with the given type.
+    """Return a given property of the client, with the given type. Node
+    properties are decoded into Python values with `decode_node`.
 
     Raises AttributeError if the property could not be found. Raises ValueError
     if the property could not be retrieved for any other reason.
@@ -292,6 +175,11 @@ def get_property(client, name, type):
         else:
             raise ValueError('{}: {}'.format(ffi.string(s), name))
 
+    if type == Format.Node:
+        try:
+            return decode_node(value[0])
+        finally:
+            libmpv.mpv_free_node_contents(value)
     return value[0]
 
 
@@ -306,27 +194,249 @@ def get_property_string(client, name):
     return v.decode('utf8')
 
 
+def observe_property(client, name, type, reply_userdata=0):
+    """Ask for MPV_EVENT_PROPERTY_CHANGE events whenever the given property
+    changes, with its value as the given type."""
+    r = libmpv.mpv_observe_property(client, reply_userdata, _get_bytes(name), _get_format(type))
+    if r != 0:
+        s = libmpv.mpv_error_string(r)
+
+        if r == libmpv.MPV_ERROR_PROPERTY_NOT_FOUND:
+            raise AttributeError('{}: {}'.format(ffi.string(s), name))
+        else:
+            raise ValueError('{}: {}'.format(ffi.string(s), name))
+
+
+def unobserve_property(client, reply_userdata):
+    libmpv.mpv_unobserve_property(client, reply_userdata)
+
+
+class EndFileReason(Enum):
+    EOF = 0
+    Stop = 2
+    Quit = 3
+    Error = 4
+
+
+class Event(namedtuple('Event', 'id error reply_userdata data')):
+    """An event from mpv, with its payload decoded into `data`:
+
+     - PropertyChange for property changes and get_property replies
+     - EndFile for MPV_EVENT_END_FILE
+     - LogMessage for MPV_EVENT_LOG_MESSAGE
+     - ClientMessage for MPV_EVENT_CLIENT_MESSAGE
+     - None for everything else
+    """
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return event_name(self.id)
+
+
+PropertyChange = namedtuple('PropertyChange', 'name value')
+EndFile = namedtuple('EndFile', 'reason error')
+LogMessage = namedtuple('LogMessage', 'prefix level text')
+ClientMessage = namedtuple('ClientMessage', 'args')
+
+
+def _string(pointer):
+    if pointer == ffi.NULL:
+        return None
+    return ffi.string(pointer).decode('utf8', 'replace')
+
+
+def _property(data):
+    prop = ffi.cast('mpv_event_property *', data)
+    name = _string(prop.name)
+
+    if prop.format == libmpv.MPV_FORMAT_NONE:
+        value = None
+    elif prop.format == libmpv.MPV_FORMAT_DOUBLE:
+        value = ffi.cast('double *', prop.data)[0]
+    elif prop.format == libmpv.MPV_FORMAT_INT64:
+        value = ffi.cast('int64_t *', prop.data)[0]
+    elif prop.format == libmpv.MPV_FORMAT_FLAG:
+        value = ffi.cast('int *', prop.data)[0]
+    elif prop.format == libmpv.MPV_FORMAT_STRING:
+        value = _string(ffi.cast('char **', prop.data)[0])
+    elif prop.format == libmpv.MPV_FORMAT_NODE:
+        value = decode_node(ffi.cast('mpv_node *', prop.data)[0])
+    else:
+        raise ValueError('Unhandled format {}'.format(prop.format))
+
+    return PropertyChange(name, value)
+
+
+def _end_file(data):
+    end_file = ffi.cast('mpv_event_end_file *', data)
+    try:
+        reason = EndFileReason(end_file.reason)
+    except ValueError:
+        reason = end_file.reason
+    return EndFile(reason, end_file.error)
+
+
+def _log_message(data):
+    message = ffi.cast('mpv_event_log_message *', data)
+    return LogMessage(_string(message.prefix), _string(message.level), _string(message.text).rstrip('\n'))
+
+
+def _client_message(data):
+    message = ffi.cast('mpv_event_client_message *', data)
+    return ClientMessage(tuple(_string(message.args[i]) for i in range(message.num_args)))
+
+
+payload_decoders = {
+    libmpv.MPV_EVENT_PROPERTY_CHANGE: _property,
+    libmpv.MPV_EVENT_GET_PROPERTY_REPLY: _property,
+    libmpv.MPV_EVENT_END_FILE: _end_file,
+    libmpv.MPV_EVENT_LOG_MESSAGE: _log_message,
+    libmpv.MPV_EVENT_CLIENT_MESSAGE: _client_message,
+}
+
+
+def decode_event(event):
+    """Return an Event for the given mpv_event.
+
+    Payloads are only valid until the next call to `mpv_wait_event`, so events
+    must be decoded straight away.
+    """
+    data = None
+    if event.data != ffi.NULL and event.event_id in payload_decoders:
+        data = payload_decoders[event.event_id](event.data)
+    return Event(event.event_id, event.error, event.reply_userdata, data)
+
+
+def error_string(error):
+    return ffi.string(libmpv.mpv_error_string(error)).decode('utf8')
+
+
 def event_name(event_id):
     return ffi.string(libmpv.mpv_event_name(event_id)).decode('utf8')
 
 
+def client_api_version():
+    """Return libmpv's client API version as a (major, minor) tuple."""
+    version = libmpv.mpv_client_api_version()
+    return (version >> 16, version & 0xffff)
+
+
+# mpv 0.38, client API 2.3, added an index argument to loadfile before its
+# options.
+LOADFILE_INDEX_VERSION = (2, 3)
+
+
 def _get_bytes(s):
     if isinstance(s, bytes):
         return s
     return str(s).encode('utf8')
 
 
-def _value_from_node(node):
-    if node.format == libmpv.MPV_FORMAT_DOUBLE:
-        return node.u.double_
-    elif node.format == libmpv.MPV_FORMAT_INT64:
+# node map keys are decoded once and interned, as the same few keys are seen
+# over and over.
+_keys = {}
+
+
+def _key(pointer):
+    raw = ffi.string(pointer)
+    try:
+        return _keys[raw]
+    except KeyError:
+        key = _keys[raw] = sys.intern(raw.decode('utf8'))
+        return key
+
+
+def decode_node(node):
+    """Convert an mpv_node to Python, recursively. Maps become dicts, arrays
+    become lists and byte arrays become bytes."""
+    format = node.format
+
+    if format == libmpv.MPV_FORMAT_STRING or format == libmpv.MPV_FORMAT_OSD_STRING:
+        return ffi.string(node.u.string).decode('utf8', 'replace')
+    elif format == libmpv.MPV_FORMAT_INT64:
         return node.u.int64
-    elif node.format == libmpv.MPV_FORMAT_FLAG:
-        return node.u.flag
-    elif node.format == libmpv.MPV_FORMAT_STRING:
-        return ffi.string(node.u.string).decode('utf8')
+    elif format == libmpv.MPV_FORMAT_DOUBLE:
+        return node.u.double_
+    elif format == libmpv.MPV_FORMAT_FLAG:
+        return bool(node.u.flag)
+    elif format == libmpv.MPV_FORMAT_NODE_MAP:
+        node_list = node.u.list
+        keys, values = node_list.keys, node_list.values
+        return {_key(keys[i]): decode_node(values[i]) for i in range(node_list.num)}
+    elif format == libmpv.MPV_FORMAT_NODE_ARRAY:
+        node_list = node.u.list
+        values = node_list.values
+        return [decode_node(values[i]) for i in range(node_list.num)]
+    elif format == libmpv.MPV_FORMAT_BYTE_ARRAY:
+        return bytes(ffi.buffer(node.u.ba.data, node.u.ba.size))
+    elif format == libmpv.MPV_FORMAT_NONE:
+        return None
+
+    raise ValueError('Unhandled format {}'.format(format))
+
+
+def encode_node(value):
+    """Convert a Python value to an mpv_node, recursively. Returns the node
+    and a list of the memory it refers to, which must be kept alive for as
+    long as the node is used."""
+    keepalive = []
+    node = ffi.new('mpv_node *')
+    keepalive.append(node)
+    _encode_node(node, value, keepalive)
+    return node, keepalive
+
+
+def _encode_node(node, value, keepalive):
+    if value is None:
+        node.format = libmpv.MPV_FORMAT_NONE
+    elif isinstance(value, bool):
+        node.format = libmpv.MPV_FORMAT_FLAG
+        node.u.flag = int(value)
+    elif isinstance(value, int):
+        node.format = libmpv.MPV_FORMAT_INT64
+        node.u.int64 = value
+    elif isinstance(value, float):
+        node.format = libmpv.MPV_FORMAT_DOUBLE
+        node.u.double_ = value
+    elif isinstance(value, (bytearray, memoryview)):
+        data = ffi.from_buffer(value)
+        byte_array = ffi.new('mpv_byte_array *', {'data': data, 'size': len(data)})
+        keepalive.extend([data, byte_array])
+        node.format = libmpv.MPV_FORMAT_BYTE_ARRAY
+        node.u.ba = byte_array
+    elif isinstance(value, (dict, list, tuple)):
+        items = list(value.items()) if isinstance(value, dict) else list(enumerate(value))
+
+        node_list = ffi.new('mpv_node_list *')
+        values = ffi.new('mpv_node[]', len(items))
+        keepalive.extend([node_list, values])
+
+        node_list.num = len(items)
+        node_list.values = values
+
+        if isinstance(value, dict):
+            keys = ffi.new('char *[]', len(items))
+            keepalive.append(keys)
+            node_list.keys = keys
+            node.format = libmpv.MPV_FORMAT_NODE_MAP
+        else:
+            node_list.keys = ffi.NULL
+            node.format = libmpv.MPV_FORMAT_NODE_ARRAY
+
+        for i, (key, item) in enumerate(items):
+            if isinstance(value, dict):
+                encoded_key = ffi.new('char[]', _get_bytes(key))
+                keepalive.append(encoded_key)
+                keys[i] = encoded_key
+            _encode_node(values + i, item, keepalive)
 
-    raise ValueError('Unhandled format {}'.format(node.format))
+        node.u.list = node_list
+    else:
+        string = ffi.new('char[]', _get_bytes(value))
+        keepalive.append(string)
+        node.format = libmpv.MPV_FORMAT_STRING
+        node.u.string = string
 
 
 def _get_value(type, default=None):
@@ -341,6 +451,12 @@ def _get_value(type, default=None):
 
     return ffi.new(c_type, default), format
 
+
+def _get_format(type):
+    if type == Format.String:
+        return libmpv.MPV_FORMAT_STRING
+    return _get_value(type)[1]
+
 Format = Enum('Format', 'String Float Int Flag Node')
 
 
@@ -368,6 +484,145 @@ class LoadFile(Enum):
     AppendPlay = 'append-play'
 
 
+def _raise_error(r, name):
+    s = libmpv.mpv_error_string(r)
+
+    if r == libmpv.MPV_ERROR_PROPERTY_NOT_FOUND:
+        raise AttributeError('{}: {}'.format(ffi.string(s), name))
+    else:
+        raise ValueError('{}: {}'.format(ffi.string(s), name))
+
+
+class Property:
+    """Accessor for a single mpv property of a Client.
+
+    One is created for each property when the class is created, with the
+    property's name already encoded and a buffer of the right type already
+    allocated, so reading a property is a single call into libmpv. The
+    buffer is shared by every client, which is fine as values are copied out
+    of it straight away.
+    """
+    __slots__ = ('name', 'encoded', 'type', 'format', 'buffer', 'readable', 'writable')
+
+    def __init__(self, name, type, access):
+        self.name = name
+        self.encoded = _get_bytes(name)
+        self.type = type
+        self.readable = 'r' in access
+        self.writable = 'w' in access
+
+        if type == Format.String:
+            self.format = libmpv.MPV_FORMAT_STRING
+            self.buffer = None
+        elif type == Format.Node:
+            self.format = libmpv.MPV_FORMAT_NODE
+            self.buffer = None
+        else:
+            self.buffer, self.format = _get_value(type)
+
+    def __get__(self, client, owner):
+        if client is None:
+            return self
+        if not self.readable:
+            raise AttributeError('{} does not have read access'.format(self.name))
+        return self.get(client.mpv)
+
+    def __set__(self, client, value):
+        if not self.writable:
+            raise AttributeError('{} does not have write access'.format(self.name))
+        self.set(client.mpv, value)
+
+    def get(self, handle):
+        if self.type == Format.Node:
+            return get_property(handle, self.encoded, Format.Node)
+        if self.buffer is None:
+            return get_property_string(handle, self.encoded)
+
+        r = libmpv.mpv_get_property(handle, self.encoded, self.format, self.buffer)
+        if r != 0:
+            _raise_error(r, self.name)
+        return self.buffer[0]
+
+    def set(self, handle, value):
+        if self.type == Format.Node:
+            return set_property(handle, self.encoded, Format.Node, value)
+        if self.buffer is None:
+            return set_property_string(handle, self.encoded, value)
+
+        self.buffer[0] = value
+        r = libmpv.mpv_set_property(handle, self.encoded, self.format, self.buffer)
+        if r != 0:
+            _raise_error(r, self.name)
+
+
+def with_properties(cls):
+    """Class decorator adding a Property for each of the class's `properties`,
+    as an attribute named with underscores instead of dashes."""
+    cls.accessors = {}
+
+    for name, (type, access) in cls.properties.items():
+        accessor = Property(name, type, access)
+        cls.accessors[name] = accessor
+        setattr(cls, name.replace('-', '_'), accessor)
+    return cls
+
+
+class Track(namedtuple('Track', 'id type lang title selected external display')):
+    """A single entry of mpv's track-list. `display` is the name to show for
+    the track, if one has been given with `TrackList.from_tracks`."""
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, props):
+        return cls(
+            id=props['id'],
+            type=props['type'],
+            lang=props.get('lang'),
+            title=props.get('title'),
+            selected=bool(props.get('selected', 0)),
+            external=bool(props.get('external', 0)),
+            display=None,
+        )
+
+
+class TrackList(namedtuple('TrackList', 'video audio sub')):
+    """Tracks partitioned by type, in the order mpv lists them."""
+    __slots__ = ()
+
+    @classmethod
+    def from_tracks(cls, tracks, display=None):
+        """Partition `tracks`. If given, `display(track)` is called once for
+        each track to set its display name."""
+        partitions = {'video': [], 'audio': [], 'sub': []}
+
+        for track in tracks:
+            if display is not None:
+                track = track._replace(display=display(track))
+            partitions.setdefault(track.type, []).append(track)
+
+        return cls(
+            tuple(partitions['video']),
+            tuple(partitions['audio']),
+            tuple(partitions['sub']),
+        )
+
+    def selected(self, type):
+        """Return the selected track of the given type, or None."""
+        for track in getattr(self, type):
+            if track.selected:
+                return track
+        return None
+
+    def ids(self):
+        """Return the (type, id) of every track, to tell tracks being added
+        or removed apart from a different track being selected."""
+        return {(track.type, track.id) for tracks in self for track in tracks}
+
+
+TrackList.empty = TrackList((), (), ())
+
+
+@with_properties
 class Client:
     properties = {
         'aid': (Format.Int, 'rw'),
@@ -389,6 +644,7 @@ class Client:
         'cache': (Format.Int, 'r'),
         'cache-size': (Format.Int, 'rw'),
         'chapter': (Format.Int, 'rw'),
+        'chapter-list': (Format.Node, 'r'),
         'chapters': (Format.Int, 'r'),
         'colormatrix': (Format.String, 'rw'),
         'colormatrix-input-range': (Format.String, 'rw'),
@@ -397,6 +653,7 @@ class Client:
         'contrast': (Format.Int, 'rw'),
         'core-idle': (Format.Flag, 'r'),
         'deinterlace': (Format.String, 'rw'),
+        'demux-cache-state': (Format.Node, 'r'),
         'dheight': (Format.Int, 'r'),
         'disc-menu-active': (Format.Flag, 'r'),
         'disc-title': (Format.String, 'rw'),
@@ -421,6 +678,7 @@ class Client:
         'loop': (Format.String, 'rw'),
         'loop-file': (Format.String, 'rw'),
         'media-title': (Format.String, 'r'),
+        'metadata': (Format.Node, 'r'),
         'mute': (Format.Flag, 'rw'),
         'ontop': (Format.Flag, 'rw'),
         'osd-height': (Format.Int, 'r'),
@@ -482,33 +740,40 @@ class Client:
     def __init__(self, **kwargs):
         self.mpv = client(**kwargs)
 
-    def __setattr__(self, attr, value):
-        if attr.replace('_', '-') in self.properties:
-            attr = attr.replace('_', '-')
-            type, access = self.properties[attr]
-
-            if 'w' in access:
-                return set_property(self.mpv, attr, type, value)
-            else:
-                raise AttributeError('{} does not have write access'.format(attr))
-
-        super().__setattr__(attr, value)
-
-    def __getattr__(self, attr):
-
-        if attr.replace('_', '-') in self.properties:
-            attr = attr.replace('_', '-')
-            type, access = self.properties[attr]
-
-            if 'r' in access:
-                return get_property(self.mpv, attr, type)
-            else:
-                raise AttributeError('{} does not have read access'.format(attr))
-        raise AttributeError(attr)
+    def get_properties(self, names):
+        """Return a dictionary of the current values of the given properties.
+        Properties that are currently unavailable are None."""
+        values = {}
+        handle = self.mpv
+
+        for name in names:
+            try:
+                values[name] = self.accessors[name].get(handle)
+            except ValueError:
+                values[name] = None
+        return values
+
+    def observe_property(self, name, type=None):
+        """Receive an MPV_EVENT_PROPERTY_CHANGE event whenever `name`
+        changes, and once straight away with its current value. `type` is
+        only needed for properties not in `properties`."""
+        if type is None:
+            type, access = self.properties[name]
+        observe_property(self.mpv, name, type)
+
+    def request_log_messages(self, level):
+        """Receive MPV_EVENT_LOG_MESSAGE events for messages of at least the
+        given level, e.g. 'warn', or 'no' to stop receiving them."""
+        r = libmpv.mpv_request_log_messages(self.mpv, _get_bytes(level))
+        if r != 0:
+            raise ValueError(ffi.string(libmpv.mpv_error_string(r)))
 
     def loadfile(self, path, add_mode=LoadFile.Replace):
         command(self.mpv, 'loadfile', path, add_mode.value)
 
+    def loadlist(self, path, add_mode=LoadFile.Replace):
+        command(self.mpv, 'loadlist', path, add_mode.value)
+
     def seek(self, seconds, seek=Seek.Relative):
         return command(self.mpv, 'seek', seconds, seek.value)
 
@@ -525,6 +790,9 @@ class Client:
     def cycle(self, property, direction=CycleDirection.Up):
         return command(self.mpv, 'cycle', property, direction.value)
 
+    def command_node(self, *args):
+        return command_node(self.mpv, *args)
+
     def playlist_next(self, playlist_nav=PlayListNav.Weak):
         return command(self.mpv, 'playlist_next', playlist_nav.value)
 
@@ -541,42 +809,16 @@ class Client:
         return command(self.mpv, 'playlist_move', src, dst)
 
     def playlist_items(self):
-        playlist = get_property(self.mpv, 'playlist', Format.Node)
-
-        try:
-            for i in range(playlist.u.list.num):
-                m = playlist.u.list.values[i]
-
-                props = {}
-
-                for j in range(m.u.list.num):
-                    key = ffi.string(m.u.list.keys[j]).decode('utf8')
-
-                    value = _value_from_node(m.u.list.values[j])
-                    props[key] = value
-
-                yield props
-        finally:
-            libmpv.mpv_free_node_contents(ffi.addressof(playlist))
+        return get_property(self.mpv, 'playlist', Format.Node)
 
     def track_list(self):
-        track_list = get_property(self.mpv, 'track-list', Format.Node)
+        return get_property(self.mpv, 'track-list', Format.Node)
 
-        try:
-            for i in range(track_list.u.list.num):
-                m = track_list.u.list.values[i]
-
-                props = {}
-
-                for j in range(m.u.list.num):
-                    key = ffi.string(m.u.list.keys[j]).decode('utf8')
-
-                    value = _value_from_node(m.u.list.values[j])
-                    props[key] = value
-
-                yield props
-        finally:
-            libmpv.mpv_free_node_contents(ffi.addressof(track_list))
+    def tracks(self, display=None):
+        """Return a TrackList of the current tracks, fetching the track list
+        from mpv once."""
+        return TrackList.from_tracks(
+            (Track.from_dict(props) for props in self.track_list()), display)
 
     def video_tracks(self):
         for track in self.track_list():
@@ -619,31 +861,135 @@ class Client:
         return command(self.mpv, 'stop')
 
 
+# events sent in reply to an asynchronous request.
+reply_events = {
+    libmpv.MPV_EVENT_COMMAND_REPLY,
+    libmpv.MPV_EVENT_GET_PROPERTY_REPLY,
+    libmpv.MPV_EVENT_SET_PROPERTY_REPLY,
+}
+
+
 class AsyncioClient(Client):
+    """Client whose events are decoded into Event tuples and put on
+    `event_queue` as they arrive.
+
+    Commands and properties can also be run asynchronously, so slow commands
+    like loading a file over the network don't block the event loop. Each
+    request gets its own reply_userdata, and the future waiting on it is
+    resolved when mpv's reply arrives, rather than the reply being queued.
+    """
     def __init__(self, loop=None, **kwargs):
         import asyncio
 
         super().__init__(**kwargs)
-        loop = loop or asyncio.get_event_loop()
+        # not `loop`, that's an mpv property.
+        self.event_loop = loop or asyncio.get_running_loop()
+
+        # observed properties use a reply_userdata of 0, so start after it.
+        self.reply_ids = itertools.count(1)
+        self.replies = {}
 
         self.fd = libmpv.mpv_get_wakeup_pipe(self.mpv)
         assert self.fd != -1
 
-        loop.add_reader(self.fd, self._read_events)
+        self.event_loop.add_reader(self.fd, self._read_events)
 
         self.event_queue = asyncio.Queue()
 
     def _read_events(self):
-        import asyncio
         os.read(self.fd, 256)
 
-        events = []
         while True:
             event = libmpv.mpv_wait_event(self.mpv, 0)
             if event.event_id == libmpv.MPV_EVENT_NONE:
                 break
 
-            events.append(event.event_id)
+            event = decode_event(event)
+
+            if event.id in reply_events and event.reply_userdata in self.replies:
+                self._resolve(self.replies.pop(event.reply_userdata), event)
+            else:
+                self.event_queue.put_nowait(event)
+
+    def _resolve(self, future, event):
+        if future.cancelled():
+            return
+
+        if event.error < 0:
+            message = error_string(event.error)
+            if event.error == libmpv.MPV_ERROR_PROPERTY_NOT_FOUND:
+                future.set_exception(AttributeError(message))
+            else:
+                future.set_exception(ValueError(message))
+        elif event.id == libmpv.MPV_EVENT_GET_PROPERTY_REPLY:
+            future.set_result(event.data.value)
+        else:
+            future.set_result(None)
+
+    async def _request(self, function, *args):
+        reply_id = next(self.reply_ids)
+        future = self.replies[reply_id] = self.event_loop.create_future()
+
+        try:
+            function(self.mpv, reply_id, *args)
+        except Exception:
+            del self.replies[reply_id]
+            raise
+
+        return await future
+
+    async def command_async(self, *args):
+        """Run a command without blocking, finishing when mpv has run it."""
+        await self._request(command_async, *args)
+
+    async def get_property_async(self, name):
+        """Return the value of a property without blocking."""
+        type, access = self.properties[name]
+        return await self._request(get_property_async, name, type)
+
+    async def set_property_async(self, name, value):
+        """Set a property without blocking, finishing when it has been set."""
+        type, access = self.properties[name]
+        await self._request(set_property_async, name, type, value)
+
+    async def loadfile_async(self, path, add_mode=LoadFile.Replace, **options):
+        """Load a file, with any per-file options given, e.g. start=60."""
+        args = ['loadfile', path, add_mode.value]
+        if options:
+            if client_api_version() >= LOADFILE_INDEX_VERSION:
+                # only used with insert-at, -1 otherwise.
+                args.append('-1')
+            args.append(','.join('{}={}'.format(key, value) for (key, value) in options.items()))
+
+        await self.command_async(*args)
+
+    async def loadlist_async(self, path, add_mode=LoadFile.Replace):
+        await self.command_async('loadlist', path, add_mode.value)
+
+    async def seek_async(self, seconds, seek=Seek.Relative):
+        await self.command_async('seek', seconds, seek.value)
+
+    async def sub_add_async(self, path, flag='cached', title='n/a', lang=''):
+        args = [path, flag, title]
+        if lang:
+            args.append(lang)
+
+        await self.command_async('sub_add', *args)
+
+    async def playlist_next_async(self, playlist_nav=PlayListNav.Weak):
+        await self.command_async('playlist_next', playlist_nav.value)
+
+    async def playlist_prev_async(self, playlist_nav=PlayListNav.Weak):
+        await self.command_async('playlist_prev', playlist_nav.value)
+
+    async def stop_async(self):
+        await self.command_async('stop')
+
+    def close(self):
+        """Stop reading events and cancel any outstanding requests. The mpv
+        handle is destroyed when the client is garbage collected."""
+        self.event_loop.remove_reader(self.fd)
 
-        asyncio.async(asyncio.gather(*[
-            self.event_queue.put(e) for e in events]))
+        for future in self.replies.values():
+            future.cancel()
+        self.replies.clear()
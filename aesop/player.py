@@ -1,28 +1,194 @@
 import asyncio
 import json
+import os
 import pathlib
 import re
+import tempfile
 
-from datetime import timedelta
+from collections import namedtuple
 from operator import itemgetter
 
 import websockets
 from logbook import Logger
 
-from aesop import events, isocodes
-from aesop.models import TVShowEpisode, Movie, Config, TVShow, init
-from aesop.mpv import AsyncioClient, LoadFile, libmpv, event_name
-from aesop.utils import setup_logging, get_language
+from aesop import events, isocodes, metrics
+from aesop.models import TVShowEpisode, Movie, Config, TVShow, ResumePoint, init
+from aesop.mpv import AsyncioClient, EndFileReason, Format, LoadFile, Seek, TrackList, libmpv, error_string, set_option
+from aesop.utils import Supervisor, setup_logging, get_language
 
 log = Logger('aesop.player')
 
 
+class Throttle:
+    """Broadcasts player attributes, each at most once every `interval`
+    seconds. Values that haven't changed since they were last sent aren't
+    sent again, and a change that arrives too soon is held back until the
+    interval is up, so the latest value is always sent eventually."""
+    def __init__(self, interval):
+        self.interval = interval
+        self.sent = {}
+        self.sent_at = {}
+        self.pending = {}
+        self.scheduled = set()
+        # broadcasts in flight, kept so they aren't garbage collected.
+        self.sending = set()
+
+    def update(self, attribute, value):
+        if attribute in self.sent and self.sent[attribute] == value:
+            self.pending.pop(attribute, None)
+            return
+
+        self.pending[attribute] = value
+        if attribute in self.scheduled:
+            return
+
+        loop = asyncio.get_running_loop()
+        delay = self.sent_at.get(attribute, float('-inf')) + self.interval - loop.time()
+
+        if delay <= 0:
+            self.flush(attribute)
+        else:
+            self.scheduled.add(attribute)
+            loop.call_later(delay, self.flush, attribute)
+
+    def flush(self, attribute):
+        self.scheduled.discard(attribute)
+        if attribute not in self.pending:
+            return
+
+        value = self.pending.pop(attribute)
+        self.sent[attribute] = value
+        self.sent_at[attribute] = asyncio.get_running_loop().time()
+        task = asyncio.ensure_future(broadcast_player_property(attribute, value))
+        self.sending.add(task)
+        task.add_done_callback(self._broadcast_done)
+
+    def _broadcast_done(self, task):
+        self.sending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error('Error broadcasting player property: {!r}', task.exception())
+
+
+class ResumeTracker:
+    """Keeps track of how far into the current file playback is, and saves
+    it as a ResumePoint. Positions are only saved when `flush` is called, so
+    the database is written to in batches rather than on every change of
+    time-pos."""
+    def __init__(self):
+        self.path = None
+        self.position = None
+        self.recorded = None
+        self.pending = {}
+
+    def start(self, path):
+        self.record()
+        self.path = path
+        self.position = self.recorded = None
+
+    def update(self, position):
+        self.position = position
+
+    def record(self):
+        if self.path is not None and self.position != self.recorded:
+            self.pending[self.path] = self.recorded = self.position
+
+    def finished(self):
+        """The current file was played to the end, so forget where it was up
+        to."""
+        if self.path is not None:
+            self.pending[self.path] = None
+        self.path = self.position = self.recorded = None
+
+    def flush(self):
+        self.record()
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, {}
+        log.debug('Saving {} resume points', len(pending))
+        ResumePoint.save_positions(pending)
+
+
+MediaInfo = namedtuple('MediaInfo', 'title type id')
+
+
+def episode_info(episode):
+    """Return the MediaInfo for an episode, which should have been selected
+    along with its show."""
+    return MediaInfo(episode.title, 'tvshow', episode.id)
+
+
+def movie_info(movie):
+    return MediaInfo(movie.title, 'movie', movie.id)
+
+
+class MediaCache:
+    """The library entry for each path the player has queued or played, so
+    the title of what's playing doesn't need to be looked up again. Filled
+    in as things are queued, and cleared whenever the library changes."""
+    def __init__(self):
+        self.media = {}
+
+    def add(self, path, info):
+        self.media[path] = info
+
+    def get(self, path):
+        try:
+            return self.media[path]
+        except KeyError:
+            info = self.media[path] = lookup_media(path)
+            return info
+
+    def clear(self):
+        self.media.clear()
+
+
+def track_display_name(track):
+    lang = track.lang or 'unk'
+    return isocodes.nicename(lang) if isocodes.exists(lang) else '{} (Unknown)'.format(lang)
+
+
+def whole_seconds(value):
+    return int(value or 0)
+
+
+# mpv properties whose changes are broadcast, with the player attribute
+# they're broadcast as and how their values are converted.
+observed_properties = {
+    'time-pos': ('time_pos', whole_seconds),
+    'length': ('length', whole_seconds),
+    'volume': ('volume', lambda value: value),
+}
+
+
+def write_playlist(paths):
+    """Write an M3U playlist of the given paths to a new temporary file,
+    returning its path. The caller removes it once mpv has loaded it."""
+    with tempfile.NamedTemporaryFile('w', suffix='.m3u', delete=False) as f:
+        f.write('#EXTM3U\n')
+        for path in paths:
+            f.write('{}\n'.format(path))
+    return f.name
+
+
 class VideoPlayer:
-    def __init__(self, **kwargs):
+    def __init__(self, broadcast_interval=1, **kwargs):
         self.client = AsyncioClient(**kwargs)
         self.subtitle_downloads = {}
-
-        asyncio.async(self.client_event_handler())
+        self.throttle = Throttle(broadcast_interval)
+        self.resume = ResumeTracker()
+        # files loaded with start= set to their resume point already.
+        self.started_at_resume_point = set()
+        self.media = MediaCache()
+        self.tracks = TrackList.empty
+
+        for name in observed_properties:
+            self.client.observe_property(name)
+        # libmpv 2 dropped the tracks-changed, track-switched and pause
+        # events, so watch the properties behind them instead.
+        self.client.observe_property('track-list', Format.Node)
+        self.client.observe_property('pause')
+        self.client.request_log_messages('warn')
 
     @property
     def audio(self):
@@ -32,16 +198,26 @@ class VideoPlayer:
             return 0
 
     def sub_language(self):
-        for track in self.client.subtitles():
-            if track.get('selected', 0):
-                return track.get('lang', 'unk')
-        return 'unk'
+        track = self.tracks.selected('sub')
+        return (track.lang if track is not None else None) or 'unk'
 
     def audio_language(self):
-        for track in self.client.audio_tracks():
-            if track.get('selected', 0):
-                return track.get('lang', 'unk')
-        return 'unk'
+        track = self.tracks.selected('audio')
+        return (track.lang if track is not None else None) or 'unk'
+
+    def refresh_tracks(self):
+        """Fetch the track list from mpv. Called whenever the tracks or the
+        selected tracks change, so everything else can use `self.tracks`."""
+        self.tracks = self.client.tracks(display=track_display_name)
+
+    async def tracks_changed(self):
+        """Refresh the tracks, broadcasting them if any were added or
+        removed rather than just selected."""
+        before = self.tracks.ids()
+        self.refresh_tracks()
+
+        if self.tracks.ids() != before:
+            await self.update_track_info()
 
     @property
     def sub(self):
@@ -65,9 +241,8 @@ class VideoPlayer:
     def paused(self):
         return self.client.pause
 
-    @paused.setter
-    def paused(self, v):
-        self.client.pause = v
+    async def set_paused(self, paused):
+        await self.client.set_property_async('pause', paused)
 
     @property
     def percent_pos(self):
@@ -83,10 +258,9 @@ class VideoPlayer:
         except ValueError:
             return None
 
-    @volume.setter
-    def volume(self, amount):
+    async def set_volume(self, amount):
         try:
-            self.client.volume = float(amount)
+            await self.client.set_property_async('volume', float(amount))
         except ValueError:
             pass
 
@@ -111,64 +285,88 @@ class VideoPlayer:
         except ValueError:
             return 0.0
 
-    def get_progress(self):
-        time_pos, length = self.time_pos, self.length
-
-        if length <= 0.0:
-            return ''
+    async def play(self, media_file, append=False):
+        options = {}
+        position = ResumePoint.position_for(media_file)
+        if position:
+            options['start'] = position
+            self.started_at_resume_point.add(media_file)
 
-        progress = str(timedelta(seconds=time_pos)).split('.')[0]
-        length = str(timedelta(seconds=length)).split('.')[0]
-        return '{} / {}'.format(progress, length)
-
-    def play(self, media_file, append=False):
-        self.client.loadfile(
+        await self.client.loadfile_async(
             media_file,
-            add_mode=LoadFile.Append if append else LoadFile.Replace
+            add_mode=LoadFile.Append if append else LoadFile.Replace,
+            **options
         )
 
-    def stop(self):
-        self.client.stop()
+    async def play_all(self, media_files, append=False):
+        """Queue several files with a single command, rather than one
+        loadfile per file."""
+        playlist = write_playlist(media_files)
+        try:
+            await self.client.loadlist_async(
+                playlist,
+                add_mode=LoadFile.Append if append else LoadFile.Replace
+            )
+        finally:
+            os.remove(playlist)
+
+    async def seek_to_resume_point(self, path):
+        """Carry on from where `path` was up to, unless it was loaded with
+        start= already. Files queued through a playlist can't be given their
+        own start=, so they're resumed here once they've loaded."""
+        if path in self.started_at_resume_point:
+            self.started_at_resume_point.discard(path)
+            return
+
+        position = ResumePoint.position_for(path)
+        if position:
+            log.info('Resuming {} from {}s', path, position)
+            try:
+                await self.client.seek_async(position, Seek.Absolute)
+            except ValueError:
+                log.warning("Couldn't resume {}", path)
 
-    def seek_backward(self, seek_size):
+    async def stop(self):
+        await self.client.stop_async()
+
+    async def seek_backward(self, seek_size):
         try:
             if self.has_chapters:
-                self.client.chapter -= 1
+                await self.client.set_property_async('chapter', self.client.chapter - 1)
             else:
-                self.client.seek(-seek_size)
+                await self.client.seek_async(-seek_size)
         except ValueError:
             pass
 
-    def seek_forward(self, seek_size):
+    async def seek_forward(self, seek_size):
         try:
             if self.has_chapters:
-                self.client.chapter += 1
+                await self.client.set_property_async('chapter', self.client.chapter + 1)
             else:
-                self.client.seek(seek_size)
+                await self.client.seek_async(seek_size)
         except ValueError:
             pass
 
-    def load_srt_subtitle(self, path, language):
-        self.client.sub_add(path, title=language, lang=language)
+    async def load_srt_subtitle(self, path, language):
+        await self.client.sub_add_async(path, title=language, lang=language)
 
-    @asyncio.coroutine
-    def set_subtitle(self, sid):
+    async def set_subtitle(self, sid):
         if isinstance(sid, str) and sid.startswith('download_'):
             offset = len('download_')
             lang = sid[offset:]
-            yield from events.broadcast(
+            await events.broadcast(
                 'download-subtitle',
                 path=self.client.path, language=lang)
             return
 
         log.info('Setting subtitle to {}', sid)
-        self.client.sub = sid
+        await self.client.set_property_async('sub', sid)
 
-    def set_audio(self, aid):
+    async def set_audio(self, aid):
         log.info('Setting subtitle to {}', aid)
-        self.client.audio = aid
+        await self.client.set_property_async('audio', aid)
 
-    def add_available_srt_subtitles(self):
+    async def add_available_srt_subtitles(self):
         path = pathlib.Path(self.client.path)
         glob = '{}*.srt'.format(path.stem)
         glob = re.sub(r'\[', '[[]', glob)
@@ -180,36 +378,67 @@ class VideoPlayer:
 
             if language is not None:
                 log.debug("Adding {} as {}", subtitle, language)
-                self.load_srt_subtitle(str(subtitle), language)
+                await self.load_srt_subtitle(str(subtitle), language)
             else:
                 log.debug("Couldn't figure out a language for {}", subtitle)
 
-    @asyncio.coroutine
-    def client_event_handler(self):
+    async def client_event_handler(self):
         while True:
-            event = yield from self.client.event_queue.get()
-
-            log.debug('mpv event received {}', event_name(event))
-
-            if event == libmpv.MPV_EVENT_FILE_LOADED:
+            event = await self.client.event_queue.get()
+
+            if event.id == libmpv.MPV_EVENT_PROPERTY_CHANGE:
+                name, value = event.data
+
+                if name in observed_properties:
+                    attribute, convert = observed_properties[name]
+                    self.throttle.update(attribute, convert(value))
+
+                    if name == 'time-pos' and value is not None:
+                        self.resume.update(int(value))
+                elif name == 'track-list':
+                    await self.tracks_changed()
+                elif name == 'pause' and value:
+                    self.resume.flush()
+                continue
+            elif event.id == libmpv.MPV_EVENT_LOG_MESSAGE:
+                log.warning('mpv {}: {}', event.data.prefix, event.data.text)
+                continue
+
+            log.debug('mpv event received {}', event.name)
+
+            if event.id == libmpv.MPV_EVENT_FILE_LOADED:
+                self.resume.start(self.client.path)
+                await self.seek_to_resume_point(self.client.path)
                 self.subtitle_downloads.clear()
-                self.add_available_srt_subtitles()
+                await self.add_available_srt_subtitles()
 
-                media = get_movie_or_tv_show(self.client.path)
-                now_playing = media.title
+                now_playing = self.media.get(self.client.path).title
                 log.info('Now playing {}', now_playing)
-                yield from asyncio.gather(
+                await asyncio.gather(
                     events.info(now_playing),
                     broadcast_player_property('now_playing', now_playing)
                 )
-            elif event == libmpv.MPV_EVENT_TRACKS_CHANGED:
-                yield from self.update_track_info()
-            elif event == libmpv.MPV_EVENT_PLAYBACK_RESTART:
-                yield from self.broadcast_volume()
-
-    @asyncio.coroutine
-    def update_track_info(self):
-        yield from asyncio.gather(
+            elif event.id == libmpv.MPV_EVENT_SEEK:
+                self.resume.flush()
+            elif event.id == libmpv.MPV_EVENT_END_FILE:
+                # the next file's tracks are all new, even if they look the same.
+                self.tracks = TrackList.empty
+                if event.data.reason == EndFileReason.EOF:
+                    self.resume.finished()
+                self.resume.flush()
+
+                if event.data.reason == EndFileReason.Error:
+                    message = 'Playback failed: {}'.format(error_string(event.data.error))
+                    log.warning(message)
+                    await events.error(message)
+
+    async def save_resume_points(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.resume.flush()
+
+    async def update_track_info(self):
+        await asyncio.gather(
             self.broadcast_available_subtitles(),
             self.broadcast_available_audio(),
             self.broadcast_subtitle(),
@@ -222,32 +451,41 @@ class VideoPlayer:
                 self.audio_language() == self.sub_language() and
                 not int(Config.get('player', 'subtitles for matching audio'))):
             log.info("Disabling subtitle as it's the same as the language")
-            self.client.sub = 0
+            await self.client.set_property_async('sub', 0)
 
-    @asyncio.coroutine
-    def broadcast_now_playing(self):
+    async def broadcast_now_playing(self):
         if self.client.path is None:
             now_playing = None
         else:
-            media = get_movie_or_tv_show(self.client.path)
-            now_playing = media.title
+            now_playing = self.media.get(self.client.path).title
+
+        await broadcast_player_property('now_playing', now_playing)
+
+    def queue(self):
+        """Return the titles of everything in mpv's playlist, including what
+        was already playing or queued."""
+        titles = []
+        for item in self.client.playlist_items():
+            try:
+                titles.append(self.media.get(item['filename']).title)
+            except Movie.DoesNotExist:
+                titles.append(pathlib.Path(item['filename']).name)
+        return titles
 
-        yield from broadcast_player_property('now_playing', now_playing)
+    async def broadcast_queue(self):
+        await broadcast_player_property('queue', self.queue())
 
-    @asyncio.coroutine
-    def broadcast_volume(self):
+    async def broadcast_volume(self):
         volume = self.volume
-        yield from broadcast_player_property('volume', volume)
+        await broadcast_player_property('volume', volume)
 
-    @asyncio.coroutine
-    def broadcast_subtitle(self):
-        yield from broadcast_player_property('selected_subtitle', str(self.sub))
+    async def broadcast_subtitle(self):
+        await broadcast_player_property('selected_subtitle', str(self.sub))
 
-    @asyncio.coroutine
-    def broadcast_available_audio(self):
+    async def broadcast_available_audio(self):
         audio_streams = [
-            dict(value=str(track['id']), display=isocodes.nicename(track.get('lang', 'unk')))
-            for track in self.client.audio_tracks()
+            dict(value=str(track.id), display=track.display)
+            for track in self.tracks.audio
         ]
 
         if len(audio_streams) <= 1:
@@ -255,13 +493,12 @@ class VideoPlayer:
         else:
             audio_streams = sorted(audio_streams, key=itemgetter('display'))
 
-        yield from broadcast_player_property('available_audio', audio_streams)
+        await broadcast_player_property('available_audio', audio_streams)
 
-    @asyncio.coroutine
-    def broadcast_available_subtitles(self):
+    async def broadcast_available_subtitles(self):
         subtitles = [
-            dict(value=str(track['id']), display=isocodes.nicename(track.get('lang', 'unk')))
-            for track in self.client.subtitles()
+            dict(value=str(track.id), display=track.display)
+            for track in self.tracks.sub
         ]
 
         if self.subtitle_downloads:
@@ -275,54 +512,62 @@ class VideoPlayer:
         else:
             subtitles = sorted(subtitles, key=itemgetter('display'))
 
-        yield from broadcast_player_property('available_subtitles', subtitles)
+        await broadcast_player_property('available_subtitles', subtitles)
+
+    async def broadcast_all_properties(self):
+        progress = self.client.get_properties(['time-pos', 'length'])
 
-    @asyncio.coroutine
-    def broadcast_all_properties(self):
-        yield from asyncio.gather(
+        await asyncio.gather(
             self.broadcast_now_playing(),
             self.broadcast_available_subtitles(),
             self.broadcast_available_audio(),
             self.broadcast_subtitle(),
             broadcast_player_property('selected_audio', str(self.audio)),
             self.broadcast_volume(),
+            broadcast_player_property('time_pos', whole_seconds(progress['time-pos'])),
+            broadcast_player_property('length', whole_seconds(progress['length'])),
         )
 
 
+commands = metrics.counter('aesop_player_commands_total', 'Websocket commands run')
+command_errors = metrics.counter('aesop_player_command_errors_total', 'Websocket commands that failed')
+command_time = metrics.histogram('aesop_player_command_seconds', 'Time taken to run a websocket command')
+
+
 class Server:
-    @asyncio.coroutine
-    def start(self):
+    async def start(self, supervisor):
+        """Start the player and its websocket server, which is returned."""
+        self.supervisor = supervisor
         alang = Config.get('player', 'preferred audio', default='eng')
         slang = Config.get('player', 'preferred subtitle', default='eng')
         vo = Config.get('player', 'video output', default='vdpau,opengl-hq,x11,opengl')
-        self.player = VideoPlayer(alang=alang, slang=slang, vo=vo, fs='yes')
-
-        asyncio.async(self.update_per_second())
-        asyncio.async(self.event_listener())
+        interval = float(Config.get('player', 'progress interval', default=1))
+        self.player = VideoPlayer(
+            broadcast_interval=interval, alang=alang, slang=slang, vo=vo, fs='yes')
 
-        yield from websockets.serve(self.handle_websocket, '0.0.0.0', 5002)
+        # prefetch-playlist opens the next file in the playlist while the
+        # current one is still playing, so moving on to it is quick. It's
+        # set separately so an mpv without it can still play.
+        try:
+            set_option(self.player.client.mpv, 'prefetch-playlist', Format.String, 'yes')
+        except (AttributeError, ValueError) as e:
+            log.warning("Couldn't enable prefetch-playlist: {}", e)
 
-    @asyncio.coroutine
-    def update_per_second(self):
-        while True:
-            path = self.player.path
+        supervisor.spawn(self.player.client_event_handler)
+        resume_interval = float(Config.get('player', 'resume interval', default=30))
+        supervisor.spawn(self.player.save_resume_points, resume_interval)
+        supervisor.spawn(self.event_listener)
+        # let the events service know the player's state, so it can pass it
+        # on to new clients.
+        supervisor.background(self.player.broadcast_all_properties())
 
-            if path:
-                percent = self.player.percent_pos
-                progress = self.player.get_progress()
+        return await websockets.serve(self.handle_websocket, '0.0.0.0', 5002)
 
-                yield from asyncio.gather(
-                    broadcast_player_property('progress_percent', percent),
-                    broadcast_player_property('progress_text', progress),
-                )
-            yield from asyncio.sleep(1)
-
-    @asyncio.coroutine
-    def event_listener(self):
-        listener = events.listener('new-client', 'subtitle-downloaded', 'available-subtitles')
+    async def event_listener(self):
+        listener = events.listener('new-client', 'subtitle-downloaded', 'available-subtitles', 'library-changed')
 
         while True:
-            event = yield from listener.wait()
+            event = await listener.wait()
 
             if event is None:
                 break
@@ -331,153 +576,168 @@ class Server:
                 if self.player.client.path == event.video_path:
                     log.debug("Adding downloaded {} as {}", event.path, event.language)
                     self.player.subtitle_downloads.pop(event.language)
-                    self.player.load_srt_subtitle(event.path, event.language)
+                    await self.player.load_srt_subtitle(event.path, event.language)
             elif event.type == 'new-client':
-                asyncio.async(self.player.broadcast_all_properties())
+                self.supervisor.background(self.player.broadcast_all_properties())
+            elif event.type == 'library-changed':
+                self.player.media.clear()
             elif event.type == 'available-subtitles':
-                current_languages = set(
-                    s.get('lang', 'Unknown Language') for s in self.player.subtitles()
-                )
+                current_languages = set(track.lang for track in self.player.tracks.sub)
 
                 for lang in event.languages:
                     if lang in current_languages:
                         continue
                     nicename = isocodes.nicename(lang) if isocodes.exists(lang) else '{} (Unknown)'.format(lang)
                     self.player.subtitle_downloads[lang] = '{} (Download)'.format(nicename)
-                asyncio.async(self.player.broadcast_available_subtitles())
+                self.supervisor.background(self.player.broadcast_available_subtitles())
 
-    @asyncio.coroutine
-    def handle_websocket(self, websocket, path):
-        client = ':'.join(map(str, websocket.writer.get_extra_info('peername')))
+    async def handle_websocket(self, websocket):
+        client = ':'.join(map(str, websocket.remote_address))
         log.info("New client {}", client)
 
-        yield from events.broadcast('new-client', private=True)
-
-        while True:
-            message = yield from websocket.recv()
-
-            if message is None:
-                return
+        try:
+            async for message in websocket:
+                message = json.loads(message)
 
-            message = json.loads(message)
+                method, arguments = message['command'], message.get('arguments', {})
 
-            method, arguments = message['command'], message.get('arguments', {})
+                await self._run_command(method, arguments)
+        except websockets.ConnectionClosed:
+            pass
 
-            yield from self._run_command(method, arguments)
+        log.info("Client {} disconnected", client)
 
-    @asyncio.coroutine
-    def _run_command(self, method, arguments):
+    async def _run_command(self, method, arguments):
         callable = getattr(self, 'ws_{}'.format(method), None)
 
         if callable is None:
             log.warning('Unhandled command {} {}', method, arguments)
         else:
+            commands.inc()
             try:
-                coro = callable(**arguments)
-                if coro is not None:
-                    yield from coro
+                with command_time.time():
+                    coro = callable(**arguments)
+                    if coro is not None:
+                        await coro
             except Exception:
+                command_errors.inc()
                 log.exception('Error running {!r}', method)
 
-    def ws_next(self):
-        self.player.client.playlist_next()
+    async def ws_next(self):
+        await self.player.client.playlist_next_async()
 
-    def ws_previous(self):
-        self.player.client.playlist_prev()
+    async def ws_previous(self):
+        await self.player.client.playlist_prev_async()
 
-    def ws_toggle(self):
-        self.player.paused = not self.player.paused
+    async def ws_toggle(self):
+        await self.player.set_paused(not self.player.paused)
 
-    def ws_play(self, id, type, append=False):
+    async def ws_play(self, id, type, append=False):
         if type == 'movie':
-            model = Movie
+            media = Movie.select().where(Movie.id == int(id)).get()
+            info = movie_info(media)
         else:
-            model = TVShowEpisode
+            media = TVShowEpisode.select(TVShowEpisode, TVShow).join(TVShow).where(
+                TVShowEpisode.id == int(id)).get()
+            info = episode_info(media)
 
-        path = model.select(model.path).where(model.id == int(id)).get().path
+        self.player.media.add(media.path, info)
+        await self.player.play(media.path, append=append)
+        await self.player.broadcast_queue()
 
-        self.player.play(path, append=append)
+    async def ws_stop(self):
+        await self.player.stop()
+        await broadcast_player_property('now_playing', None)
 
-    @asyncio.coroutine
-    def ws_stop(self):
-        self.player.stop()
-        yield from broadcast_player_property('now_playing', None)
+    async def ws_queue(self, id, type):
+        await self.ws_play(id, type, append=True)
 
-    def ws_queue(self, id, type):
-        self.ws_play(id, type, append=True)
-
-    @asyncio.coroutine
-    def ws_subtitle(self, sid):
+    async def ws_subtitle(self, sid):
         log.debug('subtitle({})', sid)
-        self.player.set_subtitle(sid or 0)
-        yield from self.player.broadcast_subtitle()
+        await self.player.set_subtitle(sid or 0)
+        await self.player.broadcast_subtitle()
 
-    @asyncio.coroutine
-    def ws_audio(self, aid):
+    async def ws_audio(self, aid):
         log.debug('audio({})', aid)
-        self.player.set_audio(aid or 0)
-        yield from broadcast_player_property('selected_audio', str(self.player.audio))
+        await self.player.set_audio(aid or 0)
+        await broadcast_player_property('selected_audio', str(self.player.audio))
 
-    @asyncio.coroutine
-    def ws_volume(self, volume):
+    async def ws_volume(self, volume):
         if volume is None:
-            yield from self.player.broadcast_volume()
+            await self.player.broadcast_volume()
             return
         log.debug('volume({})', volume)
-        self.player.volume = volume
-        yield from self.player.broadcast_volume()
+        await self.player.set_volume(volume)
+        await self.player.broadcast_volume()
 
-    @asyncio.coroutine
-    def ws_seek_forward(self):
+    async def ws_seek_forward(self):
         seek_size = int(Config.get('player', 'seek size', default=15))
-        self.player.seek_forward(seek_size)
+        await self.player.seek_forward(seek_size)
 
-    @asyncio.coroutine
-    def ws_seek_backward(self):
+    async def ws_seek_backward(self):
         seek_size = int(Config.get('player', 'seek size', default=15))
-        self.player.seek_backward(seek_size)
+        await self.player.seek_backward(seek_size)
 
-    @asyncio.coroutine
-    def ws_play_season(self, id, season, append=False):
-        # FIXME: would be great if it was configurable to play the whole season or only unwatched
-        query = TVShowEpisode.select(TVShowEpisode.path).join(TVShow).where(
+    async def ws_play_season(self, id, season, append=False):
+        query = TVShowEpisode.select(TVShowEpisode, TVShow).join(TVShow).where(
             TVShow.media_id == id,
             TVShowEpisode.season == season,
         ).order_by(TVShowEpisode.episode)
-        paths = [tv.path for tv in query]
 
-        first = True
-        for path in paths:
-            log.debug("queuing {}", path)
-            if first:
-                self.player.play(path, append=append)
-                append = True
-                first = False
-            else:
-                self.player.play(path, append=append)
+        if int(Config.get('player', 'play unwatched only', default=0)):
+            query = query.where(TVShowEpisode.watched == False)
+
+        episodes = list(query)
+        if not episodes:
+            return
 
-    @asyncio.coroutine
-    def ws_queue_season(self, id, season):
-        return self.ws_play_season(id, season, append=True)
+        log.debug("queuing {} episodes", len(episodes))
+        for episode in episodes:
+            self.player.media.add(episode.path, episode_info(episode))
 
+        await self.player.play_all([episode.path for episode in episodes], append=append)
+        await self.player.broadcast_queue()
 
-def get_movie_or_tv_show(path):
+    async def ws_queue_season(self, id, season):
+        await self.ws_play_season(id, season, append=True)
+
+
+def lookup_media(path):
+    """Return the MediaInfo for the episode or movie at the given path."""
     try:
-        media = TVShowEpisode.select().where(TVShowEpisode.path == path).get()
+        episode = TVShowEpisode.select(TVShowEpisode, TVShow).join(TVShow).where(
+            TVShowEpisode.path == path).get()
     except TVShowEpisode.DoesNotExist:
-        media = Movie.select().where(Movie.path == path).get()
-    return media
+        return movie_info(Movie.select().where(Movie.path == path).get())
+    return episode_info(episode)
+
+
+async def broadcast_player_property(attribute, value):
+    await events.broadcast(type='player', attribute=attribute, value=value)
+
 
+async def run():
+    supervisor = Supervisor()
+    server = Server()
+    servers = [
+        await server.start(supervisor),
+        await metrics.start(supervisor, metrics.PLAYER_PORT),
+    ]
+    log.info("Player started on port 5002")
 
-@asyncio.coroutine
-def broadcast_player_property(attribute, value):
-    yield from events.broadcast(type='player', attribute=attribute, value=value)
+    try:
+        await supervisor.wait()
+    finally:
+        log.info("Shutting down")
+        for running in servers:
+            running.close()
+        await asyncio.gather(*[running.wait_closed() for running in servers])
+        server.player.resume.flush()
+        server.player.client.close()
+        await events.close()
 
 
 if __name__ == '__main__':
     setup_logging('aesop.player', 'INFO')
     init()
-    server = Server()
-    asyncio.get_event_loop().run_until_complete(server.start())
-    log.info("Player started on port 5002")
-    asyncio.get_event_loop().run_forever()
+    asyncio.run(run())
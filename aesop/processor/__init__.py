@@ -8,7 +8,7 @@ import traceback
 
 from logbook import Logger, FingersCrossedHandler, default_handler
 
-from aesop.models import Config, Genre, Movie, TVShow, TVShowEpisode, database_proxy
+from aesop.models import Config, Genre, Movie, TVShow, TVShowEpisode, Statistic, database_proxy
 from aesop.utils import get, damerau_levenshtein
 
 log = Logger(__name__)
@@ -18,8 +18,7 @@ class SkipIt(Exception):
     pass
 
 
-@asyncio.coroutine
-def convoluted_imdb_lookup(lookup):
+async def convoluted_imdb_lookup(lookup):
     """This function is an atrocity."""
 
     from aesop.processor.movie import MovieLookup
@@ -38,7 +37,7 @@ def convoluted_imdb_lookup(lookup):
             'y': str(lookup.year),
         }
 
-        resp, json = yield from get('http://www.omdbapi.com/', params=params)
+        resp, json = await get('http://www.omdbapi.com/', params=params)
 
         if json['Response'] != 'False':
             media_id = json['imdbID']
@@ -52,7 +51,7 @@ def convoluted_imdb_lookup(lookup):
             'type': video_type,
         }
 
-        resp, json = yield from get('http://www.omdbapi.com/', params=params)
+        resp, json = await get('http://www.omdbapi.com/', params=params)
 
         if json.get('Response', 'True') != 'False':
             titles = sorted((
@@ -68,7 +67,7 @@ def convoluted_imdb_lookup(lookup):
                 'json': '1',
             }
 
-            resp, json = yield from get('http://www.imdb.com/xml/find', params=params)
+            resp, json = await get('http://www.imdb.com/xml/find', params=params)
 
             titles = itertools.chain(
                 json.get('title_popular', []),
@@ -115,7 +114,7 @@ def convoluted_imdb_lookup(lookup):
                 'p': 'full',
                 'type': video_type,
             }
-            resp, json = yield from get('http://www.omdbapi.com/?', params=params)
+            resp, json = await get('http://www.omdbapi.com/?', params=params)
             if json['Response'] != 'False':
                 year = int(json['Year'][:4])
                 genres = json['Genre'].split(', ')
@@ -146,7 +145,7 @@ def convoluted_imdb_lookup(lookup):
             'p': 'full',
             'type': video_type,
         }
-        resp, json = yield from get('http://www.omdbapi.com/?', params=params)
+        resp, json = await get('http://www.omdbapi.com/?', params=params)
         if json['Response'] != 'False':
             genres = json['Genre'].split(', ')
 
@@ -169,7 +168,7 @@ def name_jumble_rumble(title, titles):
     return titles[0]['id'], titles[0]['title']
 
 
-def catalog_videos(database, source, max_lookups):
+async def catalog_videos(database, source, max_lookups):
     from aesop.processor.movie import MovieLookup
     from aesop.processor.episode import AnimeLookup, TVShowLookup
 
@@ -202,11 +201,17 @@ def catalog_videos(database, source, max_lookups):
             known_paths.remove(path)
             log.info("{} does not exist, removing from database.", path)
             if model == Movie:
-                Movie.delete().where(
+                where = (
                     (Movie.path == path) |
                     Movie.path.contains(path+'|') |
                     Movie.path.contains('|'+path)
-                ).execute()
+                )
+
+                with database_proxy.transaction():
+                    watched = [m.watched for m in Movie.select(Movie.watched).where(where)]
+                    Movie.delete().where(where).execute()
+                    Statistic.adjust('movies', -len(watched))
+                    Statistic.adjust('movies watched', -sum(watched))
             else:
                 ep = TVShowEpisode.select().where(TVShowEpisode.path == path).get()
 
@@ -216,9 +221,12 @@ def catalog_videos(database, source, max_lookups):
 
                 with database_proxy.transaction():
                     ep.delete_instance()
+                    Statistic.adjust('episodes', -1)
+                    Statistic.adjust('episodes watched', -int(ep.watched))
 
                     if not list(show.episodes):
                         show.delete_instance()
+                        Statistic.adjust('series', -1)
                     else:
                         if all([episode.watched for episode in show.episodes]):
                             show.watched = True
@@ -261,16 +269,11 @@ def catalog_videos(database, source, max_lookups):
                     lookups.extend(path_lookups)
                     paths.extend([path]*len(path_lookups))
 
-    loop = asyncio.get_event_loop()
-
     log.info("{} lookups to do", len(lookups))
 
     for i in range(0, len(lookups), max_lookups):
         chunk = lookups[i:i+max_lookups]
-        f = asyncio.gather(
-                *[asyncio.async(c, loop=loop) for c in chunk],
-                loop=loop, return_exceptions=True)
-        completed = loop.run_until_complete(f)
+        completed = await asyncio.gather(*chunk, return_exceptions=True)
 
         with database.transaction():
             for path, lookup in zip(paths[i:i+max_lookups], completed):
@@ -308,6 +311,7 @@ def save_movie(lookup, path, genres):
             path=path,
             year=lookup.year,
         )
+        Statistic.adjust('movies', 1)
         if genres:
             movie.add_genres(genres)
     else:
@@ -321,6 +325,7 @@ def save_episode(lookup, path, genres, source_type):
         tvshow = TVShow.get(media_id=lookup.media_id)
     except TVShow.DoesNotExist:
         tvshow = TVShow.create(media_id=lookup.media_id, title=lookup.title, year=lookup.year, type=source_type)
+        Statistic.adjust('series', 1)
         if genres:
             tvshow.add_genres(genres)
     else:
@@ -329,3 +334,4 @@ def save_episode(lookup, path, genres, source_type):
             tvshow.save()
 
     TVShowEpisode.create(season=lookup.season, episode=lookup.episode, path=path, show=tvshow)
+    Statistic.adjust('episodes', 1)
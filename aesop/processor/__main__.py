@@ -1,11 +1,12 @@
 import argparse
+import asyncio
 
 import logbook
 
 from aesop.models import init, database_proxy, Config, Source
 from aesop.processor import catalog_videos
-from aesop import events
-from aesop.utils import setup_logging
+from aesop import bus, events
+from aesop.utils import RequestManager, setup_logging
 
 log = logbook.Logger('aesop.processor')
 
@@ -24,26 +25,37 @@ except LookupError:
 
 init()
 
-max_lookups = int(Config.get('processor', 'concurrency', default=50))
 
-sources = list(Source.select(Source.path, Source.type))
+async def scan():
+    max_lookups = int(Config.get('processor', 'concurrency', default=50))
 
-events.info.blocking("Starting scan")
-log.info("Starting scan")
+    sources = list(Source.select(Source.path, Source.type))
 
-total = unscanned = removed = 0
-for source in sources:
-    t, u, r = catalog_videos(database_proxy, source, max_lookups)
+    await events.info("Starting scan")
+    log.info("Starting scan")
 
-    total += t
-    unscanned += u
-    removed += r
+    total = unscanned = removed = 0
+    for source in sources:
+        t, u, r = await catalog_videos(database_proxy, source, max_lookups)
 
-msg = "Scan complete. {} new items, {} could not be added. {} items were removed from the db".format(total, unscanned, removed)
-log.info(msg)
-events.info.blocking(msg)
+        total += t
+        unscanned += u
+        removed += r
 
-if not sources:
-    msg = "You don't have any sources defined"
-    events.error.blocking(msg)
-    log.critical(msg)
+    msg = "Scan complete. {} new items, {} could not be added. {} items were removed from the db".format(total, unscanned, removed)
+    log.info(msg)
+    await events.info(msg)
+
+    if total or removed:
+        await events.broadcast('library-changed', private=True)
+
+    if not sources:
+        msg = "You don't have any sources defined"
+        await events.error(msg)
+        log.critical(msg)
+
+    await RequestManager.close()
+    bus.backend().close()
+
+
+asyncio.run(scan())
@@ -1,4 +1,3 @@
-import asyncio
 import collections
 import pathlib
 
@@ -99,12 +98,11 @@ class TVShowLookup(collections.namedtuple('TVShow', 'media_id title season episo
 
 
 class AnimeLookup(TVShowLookup):
-    @asyncio.coroutine
-    def full_lookup(self, path):
+    async def full_lookup(self, path):
         params = {
             'query': self.title,
         }
-        resp, json = yield from get('https://hummingbird.me/api/v1/search/anime/', params=params)
+        resp, json = await get('https://hummingbird.me/api/v1/search/anime/', params=params)
 
         def keyfunc(f):
             return {
@@ -121,7 +119,7 @@ class AnimeLookup(TVShowLookup):
         else:
             year = self.year
 
-        resp, json = yield from get('https://hummingbird.me/api/v1/anime/{}'.format(id))
+        resp, json = await get('https://hummingbird.me/api/v1/anime/{}'.format(id))
         genres = [p['name'] for p in json['genres']]
 
         return self._replace(title=title, media_id=id, year=year, genres=genres)
@@ -51,6 +51,28 @@ aesopApp.directive('eventFocus', function(focus) {
   };
 });
 
+// Fetch a list in the compact table encoding (see aesop/encoding.py) and
+// expand it back into a list of objects.
+var getTable = function($http, url) {
+  return $http.get(url, {
+    headers: {Accept: 'application/vnd.aesop.table+json'},
+  }).then(function(response) {
+    var table = response.data;
+    var genresColumn = table.columns.indexOf('genres');
+
+    return table.rows.map(function(row) {
+      var item = {};
+      table.columns.forEach(function(column, i) {
+        item[column] = row[i];
+      });
+      item.genres = row[genresColumn].map(function(genre) {
+        return table.genres[genre];
+      });
+      return item;
+    });
+  });
+};
+
 var makeBreadcrumbs = function($http, seriesID, season) {
   var breadcrumbs = [];
 
@@ -205,21 +227,23 @@ aesopApp.config(['growlProvider', function(growlProvider) {
   growlProvider.globalDisableIcons(true);
 }]);
 
-aesopApp.controller('MainController', function($scope, $state, Player, growl, $websocket) {
+var eventsResource = 'ws/events/?topics=player,notification,watched,library-changed';
+
+aesopApp.controller('MainController', function($scope, $state, Player, SeriesCache, growl, $websocket) {
   $scope.mobileHidden = true;
   $scope.refresh = function() {
     $state.reload();
   };
   $scope.Player = Player;
 
-  var socket = $websocket(wsPath('ws/events/'));
+  var socket = $websocket(wsPath(eventsResource));
 
   var reconnector;
   var reconnectWaitTime = 0.5;
   var reconnect = function() {
     console.log('reconnecting in ' + reconnectWaitTime + ' seconds');
     var reconnector = setTimeout(function() {
-      socket = $websocket(wsPath('ws/events/'));
+      socket = $websocket(wsPath(eventsResource));
       socket.onOpen(function() {
         console.log('successfully reconnected');
         if (!!reconnector) {
@@ -234,13 +258,37 @@ aesopApp.controller('MainController', function($scope, $state, Player, growl, $w
   socket.onClose(reconnect);
   socket.onMessage(onMessage);
 
+  // Formats seconds like "1:02:03", matching Python's timedelta.
+  function formatSeconds(seconds) {
+    var pad = function(n) { return (n < 10 ? '0' : '') + n; };
+    return Math.floor(seconds / 3600) + ':' + pad(Math.floor(seconds / 60) % 60) + ':' + pad(seconds % 60);
+  }
+
+  function updateProgress() {
+    if (!Player.length) {
+      Player.progress_text = '';
+      Player.progress_percent = 0;
+      return;
+    }
+
+    Player.progress_text = formatSeconds(Player.time_pos) + ' / ' + formatSeconds(Player.length);
+    Player.progress_percent = 100 * Player.time_pos / Player.length;
+  }
+
   function onMessage(ev) {
     var j = JSON.parse(ev.data);
 
-    if (j.type === 'player') {
-      console.log(j);
-      Player[j.attribute] = j.value;
+    if (j.type === 'player-state') {
+      angular.extend(Player, j.changes);
+      if ('time_pos' in j.changes || 'length' in j.changes) {
+        updateProgress();
+      }
+      $scope.$digest();
+    } else if (j.type === 'watched') {
+      $scope.$broadcast('watched', j);
       $scope.$digest();
+    } else if (j.type === 'library-changed') {
+      SeriesCache.clear();
     } else if (j.type === 'notification') {
       var icon = {
         'success': '<i class="fa fa-success"></i> ',
@@ -400,8 +448,8 @@ aesopApp.controller('MovieController', function($scope, $http, Player) {
 
   $scope.media_type = 'movie';
   $scope.media = [];
-  $http.get(url).success(function(data) {
-    $scope.media = data.data;
+  getTable($http, url).then(function(movies) {
+    $scope.media = movies;
   });
 
   $scope.play = function(id) {
@@ -417,12 +465,24 @@ aesopApp.controller('MovieController', function($scope, $http, Player) {
       video.watched = data.watched;
     });
   };
+
+  $scope.$on('watched', function(ev, change) {
+    if (change.media !== 'movies') {
+      return;
+    }
+
+    $scope.media.forEach(function(movie) {
+      if (change.ids.indexOf(movie.id) !== -1) {
+        movie.watched = change.watched;
+      }
+    });
+  });
 });
 
 aesopApp.controller('SeriesListController', function($scope, $stateParams, $http) {
   $scope.seriesList = [];
-  $http.get('/series').success(function(data) {
-    $scope.seriesList = data.data;
+  getTable($http, '/series').then(function(series) {
+    $scope.seriesList = series;
 
     $scope.seriesList.forEach(function(f) {
       var title = f.title;
@@ -434,7 +494,61 @@ aesopApp.controller('SeriesListController', function($scope, $stateParams, $http
   $scope.breadcrumbs = [];
 });
 
-aesopApp.controller('SeriesController', function($scope, $stateParams, $http, Player) {
+// Holds the most recently opened series, so moving between its seasons
+// doesn't need another request. It's fetched again each time the series
+// itself is opened, and dropped whenever the library changes.
+aesopApp.factory('SeriesCache', function($http, $q) {
+  var cached = null;
+
+  return {
+    clear: function() {
+      cached = null;
+    },
+    get: function(seriesID) {
+      if (!!cached && cached.media_id === seriesID) {
+        return $q.when(cached);
+      }
+
+      return $http.get('/series/' + seriesID + '/all').then(function(response) {
+        cached = response.data.data;
+        sessionStorage.setItem(seriesID, cached.title);
+        return cached;
+      });
+    },
+    // Apply a 'watched' event to the cached series.
+    update: function(change) {
+      if (!cached || (change.media === 'series' && change.series !== cached.media_id)) {
+        return;
+      }
+
+      cached.seasons.forEach(function(season) {
+        var matchesSeason = change.media === 'series' && (change.season === undefined || change.season === season.season);
+
+        season.episodes.forEach(function(episode) {
+          if (matchesSeason || (change.media === 'episodes' && change.ids.indexOf(episode.id) !== -1)) {
+            episode.watched = change.watched;
+          }
+        });
+
+        season.watched = season.episodes.every(function(episode) {
+          return episode.watched;
+        });
+      });
+    },
+    season: function(seriesID, season) {
+      return this.get(seriesID).then(function(series) {
+        for (var i = 0; i < series.seasons.length; i++) {
+          if (String(series.seasons[i].season) === String(season)) {
+            return series.seasons[i].episodes;
+          }
+        }
+        return [];
+      });
+    },
+  };
+});
+
+aesopApp.controller('SeriesController', function($scope, $stateParams, $http, Player, SeriesCache) {
   $scope.seasons = [];
   $scope.media_id = $stateParams.seriesID;
 
@@ -446,14 +560,26 @@ aesopApp.controller('SeriesController', function($scope, $stateParams, $http, Pl
     Player.queueSeason($scope.media_id, seasonNumber);
   };
 
-  $http.get('/series/' + $scope.media_id + '/seasons').success(function(data) {
-    $scope.seasons = data.data;
+  $scope.toggleWatched = function(season) {
+    $http.post('/series/' + $scope.media_id + '/seasons/' + season.season + '/setwatched', {
+      watched: !season.watched,
+    });
+  };
+
+  $scope.$on('watched', function(ev, change) {
+    SeriesCache.update(change);
   });
 
-  $scope.breadcrumbs = makeBreadcrumbs($http, $scope.media_id);
+  SeriesCache.clear();
+  SeriesCache.get($scope.media_id).then(function(series) {
+    $scope.seasons = series.seasons;
+    $scope.breadcrumbs = makeBreadcrumbs($http, $scope.media_id);
+  });
+
+  $scope.breadcrumbs = [];
 });
 
-aesopApp.controller('SeasonController', function($scope, $http, $stateParams, Player) {
+aesopApp.controller('SeasonController', function($scope, $http, $stateParams, Player, SeriesCache) {
   $scope.media_type = 'series';
   $scope.media = [];
   $scope.media_id = $stateParams.seriesID;
@@ -461,15 +587,21 @@ aesopApp.controller('SeasonController', function($scope, $http, $stateParams, Pl
   $scope.toggleWatched = function(videoID, video) {
     $http.post('/series/setwatched/' + videoID).success(function(data) {
       video.watched = data.watched;
+      // so the season's watched state is recomputed too.
+      SeriesCache.update({media: 'episodes', ids: [videoID], watched: data.watched});
     });
   };
 
-  var url = '/series/' + $scope.media_id + '/episodes/' + $scope.season;
-  $http.get(url).success(function(data) {
-    $scope.media = data.data;
+  $scope.$on('watched', function(ev, change) {
+    SeriesCache.update(change);
   });
 
-  $scope.breadcrumbs = makeBreadcrumbs($http, $scope.media_id, $scope.season);
+  SeriesCache.season($scope.media_id, $scope.season).then(function(episodes) {
+    $scope.media = episodes;
+    $scope.breadcrumbs = makeBreadcrumbs($http, $scope.media_id, $scope.season);
+  });
+
+  $scope.breadcrumbs = [];
 
   $scope.play = function(id) {
     Player.play(id, 'tv');
@@ -10,12 +10,16 @@ import aiohttp
 from aioxmlrpc.client import ServerProxy
 from logbook import Logger
 
-from aesop import isocodes, events
-from aesop.utils import setup_logging
+from aesop import isocodes, events, metrics
+from aesop.utils import Supervisor, setup_logging
 
 log = Logger('aesop.subtitles')
 
 
+subtitle_searches = metrics.counter('aesop_subtitle_searches_total', 'Searches for subtitles on OpenSubtitles')
+search_time = metrics.histogram('aesop_subtitle_search_seconds', 'Time taken to search OpenSubtitles')
+subtitle_downloads = metrics.counter('aesop_subtitle_downloads_total', 'Subtitles downloaded')
+
 AvailableSubtitle = collections.namedtuple('AvailableSubtitle', 'download_count lang url')
 
 
@@ -76,8 +80,7 @@ def hash_thesubdb(video_path):
     return hashlib.md5(data).hexdigest(), filesize
 
 
-@asyncio.coroutine
-def from_opensubtitles(media_path, requested_language=None):
+async def from_opensubtitles(media_path, requested_language=None):
     searches = []
 
     hash, size = hash_opensubtitles(media_path)
@@ -86,13 +89,15 @@ def from_opensubtitles(media_path, requested_language=None):
         server = ServerProxy('http://api.opensubtitles.org/xml-rpc')
         log.debug("Authenticating to opensubtitles")
 
-        response = yield from server.LogIn('', '', 'eng', 'aesop v0.1')
+        response = await server.LogIn('', '', 'eng', 'aesop v0.1')
         token = response['token']
 
         searches.append({'moviehash': hash, 'moviebytesize': str(size)})
 
         log.debug("Searching opensubtitles for {}", searches)
-        response = yield from server.SearchSubtitles(token, searches)
+        subtitle_searches.inc()
+        with search_time.time():
+            response = await server.SearchSubtitles(token, searches)
         raw_subtitles = response['data']
 
         if not raw_subtitles:
@@ -114,8 +119,8 @@ def from_opensubtitles(media_path, requested_language=None):
             sub = AvailableSubtitle(downloads, lang, url)
             subtitles.append(sub)
 
-        yield from server.LogOut(token)
-        yield from server.close()
+        await server.LogOut(token)
+        await server.close()
     else:
         subtitles = []
 
@@ -124,8 +129,7 @@ def from_opensubtitles(media_path, requested_language=None):
     return subtitles
 
 
-@asyncio.coroutine
-def download_subtitles(path, language):
+async def download_subtitles(path, language):
     nicename = isocodes.nicename(language)
     suffix = '.{}.srt'.format(nicename)
     subpath = pathlib.Path(path).with_suffix(suffix)
@@ -134,18 +138,18 @@ def download_subtitles(path, language):
         log.info("{} already exists, not downloading", subpath)
         return
 
-    subtitles = yield from from_opensubtitles(path, requested_language=language)
+    subtitles = await from_opensubtitles(path, requested_language=language)
 
     for subtitle in subtitles:
         log.info("Attempting to download {}", subtitle.url)
 
-        resp = yield from aiohttp.request('GET', subtitle.url)
-        if resp.status != 200:
-            log.info("{} for {}, ignoring", resp.status, subtitle.url)
-            continue
-
         try:
-            data = yield from resp.read_and_close()
+            async with aiohttp.ClientSession() as session, session.get(subtitle.url) as resp:
+                if resp.status != 200:
+                    log.info("{} for {}, ignoring", resp.status, subtitle.url)
+                    continue
+
+                data = await resp.read()
         except Exception:
             log.exception("Error downloading {}", subtitle.url)
             continue
@@ -167,30 +171,47 @@ def download_subtitles(path, language):
             log.exception("Could not write to {}", path)
             continue
 
+        subtitle_downloads.inc()
         log.info("Downloaded {} subtitle for {} to {}", nicename, path, subpath)
         return subpath
 
 
-def main():
+async def handle_events():
     listener = events.listener('download-subtitle', 'list-subtitles')
 
-    while True:
-        event = yield from listener.wait()
+    try:
+        while True:
+            event = await listener.wait()
+
+            if event is None:
+                break
+
+            if event.type == 'list-subtitles':
+                subtitles = await from_opensubtitles(event.path)
+                languages = sorted(set(s.lang for s in subtitles))
+                log.info("Available languages for {}: {}", event.path, languages)
+                await events.broadcast('available-subtitles', path=event.path, languages=languages)
+            else:
+                result = await download_subtitles(event.path, event.language)
+                if result:
+                    await events.broadcast('subtitle-downloaded', path=str(result), video_path=event.path, language=event.language)
+    finally:
+        listener.close()
+
+
+async def main():
+    supervisor = Supervisor()
+    supervisor.spawn(handle_events)
+    metrics_server = await metrics.start(supervisor, metrics.SUBTITLES_PORT)
 
-        if event is None:
-            break
+    try:
+        await supervisor.wait()
+    finally:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+        await events.close()
 
-        if event.type == 'list-subtitles':
-            subtitles = yield from from_opensubtitles(event.path)
-            languages = sorted(set(s.lang for s in subtitles))
-            log.info("Available languages for {}: {}", event.path, languages)
-            yield from events.broadcast('available-subtitles', path=event.path, languages=languages)
-        else:
-            result = yield from download_subtitles(event.path, event.language)
-            if result:
-                yield from events.broadcast('subtitle-downloaded', path=str(result), video_path=event.path, language=event.language)
 
 if __name__ == '__main__':
     setup_logging('aesop.ui', 'INFO')
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    asyncio.run(main())
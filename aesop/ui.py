@@ -1,26 +1,81 @@
+import asyncio
+import mimetypes
+import os
 import pathlib
+import time
 from collections import defaultdict
 from operator import itemgetter
 from itertools import groupby
 
-from flask import Flask, send_from_directory, request, jsonify
+from flask import Flask, send_from_directory, request, jsonify, g
 from logbook import Logger
+from peewee import fn
 
-from aesop import isocodes, events
-from aesop.models import Movie, TVShow, TVShowEpisode, Source, Config, database_proxy, Genre, MovieGenre, TVShowGenre
+from aesop import assets, encoding, isocodes, events, metrics
+from aesop.models import Movie, TVShow, TVShowEpisode, Source, Config, database_proxy, Genre, MovieGenre, TVShowGenre, Statistic
 
 app = Flask('aesop.ui')
 log = Logger('aesop.ui')
 
 
+# fingerprinted assets never change, so they can be cached forever.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+precompressed_encodings = [('br', '.br'), ('gzip', '.gz')]
+
+http_requests = metrics.counter('aesop_ui_requests_total', 'HTTP requests handled')
+request_time = metrics.histogram('aesop_ui_request_seconds', 'Time taken to handle an HTTP request')
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.monotonic()
+
+
+@app.after_request
+def record_request(response):
+    http_requests.inc()
+    request_time.observe(time.monotonic() - g.request_started)
+    return response
+
+
 @app.route('/')
 def root():
     templates = str(pathlib.Path(__file__).with_name('templates'))
-    return send_from_directory(templates, 'index.html')
+    response = send_from_directory(templates, assets.built_template('index.html'))
+    # the index references the fingerprinted assets, so it must always be
+    # revalidated to pick up new builds.
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/static/dist/<path:filename>')
+def dist(filename):
+    """Serve fingerprinted assets built by `aesop.assets`, preferring a
+    precompressed copy if the client accepts it."""
+    directory = str(assets.DIST)
+
+    for content_encoding, suffix in precompressed_encodings:
+        if content_encoding in request.accept_encodings and (assets.DIST / (filename + suffix)).is_file():
+            mimetype = mimetypes.guess_type(filename)[0]
+            response = send_from_directory(directory, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = content_encoding
+            break
+    else:
+        response = send_from_directory(directory, filename)
+
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
 
 
 @app.route('/series')
 def series():
+    fields = [TVShow.id, TVShow.media_id, TVShow.title, TVShow.year, TVShow.type, TVShow.watched]
+    compact = compact_response(TVShow, fields, TVShowGenre)
+    if compact is not None:
+        return compact
+
     series = list(TVShow.select().order_by(TVShow.title).dicts())
     tvshow_genre_map = Genre.select(TVShowGenre.media, Genre.text).join(TVShowGenre).tuples()
 
@@ -48,42 +103,108 @@ def set_watched_series(video_id):
     with database_proxy.transaction():
         m.watched = not m.watched
         m.save()
-        show = m.show
-        if all([episode.watched for episode in show.episodes]):
-            show.watched = True
-            if show.is_dirty():
-                show.save()
+        Statistic.adjust('episodes watched', 1 if m.watched else -1)
+        TVShow.update_watched([m.show_id])
+    events.broadcast.blocking('watched', media='episodes', ids=[video_id], watched=m.watched)
     return jsonify({'watched': m.watched})
 
 
-@app.route('/series/<id>/seasons')
-def seasons(id):
-    tvshow = TVShow.select().where(TVShow.media_id == id).get()
-    seasons = tvshow.episodes.select(TVShowEpisode.season, TVShowEpisode.watched).group_by(TVShowEpisode.season, TVShowEpisode.watched).dicts()
+@app.route('/series/<id>/setwatched', methods=['POST'])
+def set_watched_whole_series(id):
+    watched = bool(request.json['watched'])
+    show_id = TVShow.select(TVShow.id).where(TVShow.media_id == id)
+    set_watched_episodes(TVShowEpisode.show == show_id, watched, show_id)
+    events.broadcast.blocking('watched', media='series', series=id, watched=watched)
+    return jsonify({'watched': watched})
+
 
-    collapsed_seasons = defaultdict(bool)
+@app.route('/series/<id>/seasons/<int:season>/setwatched', methods=['POST'])
+def set_watched_season(id, season):
+    watched = bool(request.json['watched'])
+    show_id = TVShow.select(TVShow.id).where(TVShow.media_id == id)
+    set_watched_episodes((TVShowEpisode.show == show_id) & (TVShowEpisode.season == season), watched, show_id)
+    events.broadcast.blocking('watched', media='series', series=id, season=season, watched=watched)
+    return jsonify({'watched': watched})
 
-    for season in seasons:
-        watched = season['watched']
-        season = season['season']
 
-        if season in collapsed_seasons:
-            watched = collapsed_seasons[season] and watched
-        collapsed_seasons[season] = watched
+@app.route('/episodes/setwatched', methods=['POST'])
+def set_watched_episode_list():
+    watched = bool(request.json['watched'])
+    ids = [int(i) for i in request.json['ids']]
+    show_ids = TVShowEpisode.select(TVShowEpisode.show).where(TVShowEpisode.id << ids).distinct()
+    set_watched_episodes(TVShowEpisode.id << ids, watched, show_ids)
+    events.broadcast.blocking('watched', media='episodes', ids=ids, watched=watched)
+    return jsonify({'watched': watched})
 
-    seasons = [dict(season=season, watched=watched) for (season, watched) in collapsed_seasons.items()]
-    return jsonify({'data': seasons})
+
+def set_watched_episodes(where, watched, show_ids):
+    """Set `watched` on every episode matching `where` and recompute the
+    watched state of the affected shows, in a single transaction."""
+    with database_proxy.transaction():
+        changed = TVShowEpisode.update(watched=watched).where(where, TVShowEpisode.watched != watched).execute()
+        Statistic.adjust('episodes watched', changed if watched else -changed)
+        TVShow.update_watched(show_ids)
+
+
+@app.route('/series/<id>/seasons')
+def seasons(id):
+    show_id = TVShow.select(TVShow.id).where(TVShow.media_id == id)
+    return jsonify({'data': list(season_summaries(show_id))})
 
 
 @app.route('/series/<id>/episodes/<int:season>')
 def episodes(id, season):
-    tvshow = TVShow.select().where(TVShow.media_id == id).get()
+    query = TVShowEpisode.select().join(TVShow).where(
+        TVShow.media_id == id,
+        TVShowEpisode.season == season,
+    ).order_by(TVShowEpisode.episode)
+
+    return jsonify({'data': list(query.dicts())})
+
+
+@app.route('/series/<id>/all')
+def whole_series(id):
+    """Return the show, its seasons and every episode in one response, so
+    the UI doesn't need a request per season."""
+    tvshow = TVShow.select().where(TVShow.media_id == id).dicts().get()
+
+    query = TVShowEpisode.select().where(
+        TVShowEpisode.show == tvshow['id']
+    ).order_by(TVShowEpisode.season, TVShowEpisode.episode)
+
+    episodes = defaultdict(list)
+    for episode in query.dicts():
+        episodes[episode['season']].append(episode)
+
+    seasons = []
+    for season in season_summaries(tvshow['id']):
+        season['episodes'] = episodes[season['season']]
+        seasons.append(season)
+
+    tvshow['seasons'] = seasons
+    return jsonify({'data': tvshow})
 
-    return jsonify({'data': list(tvshow.episodes.select().where(TVShowEpisode.season == season).order_by(TVShowEpisode.episode).dicts())})
+
+def season_summaries(show_id):
+    """Yield each season of a show, which is watched if all of its episodes
+    are watched. `show_id` may be an id or a subquery selecting one."""
+    query = TVShowEpisode.select(
+        TVShowEpisode.season,
+        fn.MIN(TVShowEpisode.watched).alias('watched'),
+    ).where(
+        TVShowEpisode.show == show_id
+    ).group_by(TVShowEpisode.season).order_by(TVShowEpisode.season)
+
+    for season, watched in query.tuples():
+        yield dict(season=season, watched=bool(watched))
 
 
 @app.route('/movies')
 def movies():
+    compact = compact_response(Movie, [Movie.id, Movie.title, Movie.watched, Movie.year], MovieGenre)
+    if compact is not None:
+        return compact
+
     movies = list(Movie.select(Movie.id, Movie.title, Movie.watched, Movie.year).order_by(Movie.title).dicts())
     movie_genre_map = Genre.select(MovieGenre.media, Genre.text).join(MovieGenre).tuples()
 
@@ -97,14 +218,46 @@ def movies():
     return jsonify({'data': movies})
 
 
+def compact_response(model, fields, join_class):
+    """Return a streamed response of `fields` for every `model` in one of
+    the compact encodings, if the client asked for one."""
+    mimetype = request.accept_mimetypes.best_match(encoding.mimetypes())
+    if mimetype in (None, encoding.JSON_MIMETYPE):
+        return None
+
+    genres = []
+    genre_index = {}
+    for genre_id, text in Genre.select(Genre.id, Genre.text).order_by(Genre.text).tuples():
+        genre_index[genre_id] = len(genres)
+        genres.append(text)
+
+    media_genres = defaultdict(list)
+    for media_id, genre_id in join_class.select(join_class.media, join_class.genre).tuples():
+        media_genres[media_id].append(genre_index[genre_id])
+
+    query = model.select(*fields).order_by(model.title)
+    rows = (row + (media_genres[row[0]],) for row in query.tuples().iterator())
+    columns = [f.name for f in fields] + ['genres']
+
+    response = app.response_class(
+        encoding.table(mimetype, columns, genres, rows, query.count),
+        mimetype=mimetype)
+    response.headers['Vary'] = 'Accept'
+    return response
+
+
 @app.route('/movies/<int:id>', methods=['GET', 'POST'])
 def movie(id):
     if request.method == 'POST':
         genres = request.json['movie'].pop('genres')
 
-        Movie.update(**request.json['movie']).where(Movie.id == id).execute()
-        m = Movie.get(Movie.id == id)
-        m.replace_genres([Genre.get_or_create(g) for g in genres])
+        with database_proxy.transaction():
+            was_watched = Movie.select(Movie.watched).where(Movie.id == id).get().watched
+            Movie.update(**request.json['movie']).where(Movie.id == id).execute()
+            m = Movie.get(Movie.id == id)
+            Statistic.adjust('movies watched', int(m.watched) - int(was_watched))
+            m.replace_genres([Genre.get_or_create(g) for g in genres])
+        events.broadcast.blocking('library-changed')
         return jsonify({'status': 'ok'})
     else:
         movie = Movie.select().where(Movie.id == id).dicts().get()
@@ -118,11 +271,24 @@ def movie(id):
 @app.route('/movies/setwatched/<int:video_id>', methods=['POST'])
 def set_watched_movie(video_id):
     m = Movie.select(Movie.id, Movie.watched).where(Movie.id == video_id).get()
-    m.watched = not m.watched
-    m.save()
+    with database_proxy.transaction():
+        m.watched = not m.watched
+        m.save()
+        Statistic.adjust('movies watched', 1 if m.watched else -1)
     return jsonify({'watched': m.watched})
 
 
+@app.route('/movies/setwatched', methods=['POST'])
+def set_watched_movie_list():
+    watched = bool(request.json['watched'])
+    ids = [int(i) for i in request.json['ids']]
+    with database_proxy.transaction():
+        changed = Movie.update(watched=watched).where(Movie.id << ids, Movie.watched != watched).execute()
+        Statistic.adjust('movies watched', changed if watched else -changed)
+    events.broadcast.blocking('watched', media='movies', ids=ids, watched=watched)
+    return jsonify({'watched': watched})
+
+
 @app.route('/genres')
 def genres():
     return jsonify({'genres': [g[0] for g in Genre.select(Genre.text).order_by(Genre.text).tuples()]})
@@ -169,21 +335,7 @@ def settings():
 
 @app.route('/stats/')
 def stats():
-    series = TVShow.select().count()
-    episodes = TVShowEpisode.select().count()
-    episodes_watched = TVShowEpisode.select().where(TVShowEpisode.watched == True).count()
-    movies = Movie.select().count()
-    movies_watched = Movie.select().where(Movie.watched == True).count()
-
-    stats = {
-        'series': series,
-        'episodes': episodes,
-        'episodes watched': episodes_watched,
-        'movies': movies,
-        'movies watched': movies_watched,
-    }
-
-    return jsonify({'stats': stats})
+    return jsonify({'stats': Statistic.all()})
 
 
 @app.route('/manifest.json')
@@ -253,7 +405,10 @@ help_map = {
     'frequency': 'How frequently to scan for new videos',
     'theme': 'Website theme to use',
     'seek size': 'Amount of time in seconds to jump forward/backward',
+    'progress interval': 'How often in seconds playback progress is sent to clients',
     'subtitles for matching audio': 'Should subtitles be automatically enabled if the audio and subtitles language are the same?',
+    'play unwatched only': 'Should playing a season skip episodes that have already been watched?',
+    'resume interval': 'How often in seconds the playback position is saved, so videos can resume where they left off',
     'video output': 'Video Output Driver. Messing with this can break things so be careful',
 }
 
@@ -289,9 +444,21 @@ extras_map = {
             '0': 'No',
         },
     },
+    'play unwatched only': {
+        'choices': {
+            '1': 'Yes',
+            '0': 'No',
+        },
+    },
     'concurrency': {
         'type': 'number',
     },
+    'progress interval': {
+        'type': 'number',
+    },
+    'resume interval': {
+        'type': 'number',
+    },
 }
 
 
@@ -312,11 +479,23 @@ def config_with_help(config):
     return config
 
 
+def serve_metrics():
+    """Serve metrics on the UI's local-only metrics port, like the other
+    services, rather than through Flask where nginx would expose them. Flask
+    has no event loop, so the server runs on the one `.blocking` calls use."""
+    asyncio.run_coroutine_threadsafe(
+        metrics.serve(metrics.UI_PORT), events.blocking_loop()).result()
+
+
 def main():
     from aesop.models import init
     from aesop.utils import setup_logging
     setup_logging('aesop.ui', 'INFO')
     init()
+    # the reloader runs main in a watcher process as well as the one serving
+    # requests, and only the latter should take the metrics port.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        serve_metrics()
     app.run(debug=True, host='0.0.0.0')
 
 
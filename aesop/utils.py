@@ -1,8 +1,12 @@
 import asyncio
 import os
+import signal
 from urllib.parse import urlparse
 
 import aiohttp
+from logbook import Logger
+
+log = Logger('aesop.utils')
 
 
 def damerau_levenshtein(first_string, second_string):
@@ -32,11 +36,9 @@ def damerau_levenshtein(first_string, second_string):
     return current[len(second_string) - 1]
 
 
-def complete(value):
+async def complete(value):
     """asyncio equivalent to `twisted.internet.defer.succeed`"""
-    f = asyncio.Future()
-    f.set_result(value)
-    return f
+    return value
 
 
 roman_numeral_table = [
@@ -81,7 +83,7 @@ class RequestManager:
 
     current_requests = {}
     limits = {}
-    CONN_POOL = aiohttp.TCPConnector()
+    CONN_POOL = None
 
     count = 0
 
@@ -92,6 +94,20 @@ class RequestManager:
             cls.limits[key] = asyncio.BoundedSemaphore(limit)
         return cls.limits[key]
 
+    @classmethod
+    def get_connector(cls):
+        # connectors belong to the loop they're created in, so this can't be
+        # done at import time.
+        if cls.CONN_POOL is None:
+            cls.CONN_POOL = aiohttp.TCPConnector()
+        return cls.CONN_POOL
+
+    @classmethod
+    async def close(cls):
+        if cls.CONN_POOL is not None:
+            await cls.CONN_POOL.close()
+            cls.CONN_POOL = None
+
     def __init__(self, url, **kwargs):
         self.url = url
         self.kwargs = kwargs
@@ -99,16 +115,17 @@ class RequestManager:
 
         RequestManager.count += 1
 
-    @asyncio.coroutine
-    def run(self):
+    async def run(self):
         key = urlparse(self.url).netloc
 
         p = self.get_pool(key)
-        with (yield from p):
-            response = yield from aiohttp.request('GET', self.url, connector=self.CONN_POOL, **self.kwargs)
-
         try:
-            json = yield from response.json()
+            async with p:
+                # the connector is shared between requests, so the session
+                # mustn't close it.
+                async with aiohttp.ClientSession(connector=self.get_connector(), connector_owner=False) as session, \
+                        session.get(self.url, **self.kwargs) as response:
+                    json = await response.json()
         except Exception as e:
             for cb in self.callbacks:
                 cb.set_exception(e)
@@ -129,7 +146,7 @@ def get(url, **kwargs):
 
     r = RequestManager(url, **kwargs)
     RequestManager.current_requests[full_url] = r
-    asyncio.async(r.run())
+    asyncio.ensure_future(r.run())
 
     cb = r.wait_for()
 
@@ -140,6 +157,82 @@ def get(url, **kwargs):
     return r.wait_for()
 
 
+# seconds to wait before restarting a supervised task that failed.
+RESTART_DELAY = 1
+
+
+class Supervisor:
+    """Owns a service's long running tasks.
+
+    Tasks started with `spawn()` are logged and restarted if they fail.
+    `wait()` runs until the service is stopped, by SIGINT, SIGTERM or
+    `stop()`, and then cancels every task and waits for them to finish.
+    """
+    def __init__(self):
+        self.tasks = set()
+        self.stopping = asyncio.Event()
+
+    def spawn(self, func, *args, restart=True):
+        """Run `func(*args)` in a task. If it returns, the service stops."""
+        task = asyncio.ensure_future(self._supervise(func, args, restart))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _supervise(self, func, args, restart):
+        while True:
+            try:
+                await func(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("{} failed", func.__qualname__)
+                if restart:
+                    await asyncio.sleep(RESTART_DELAY)
+                    continue
+            break
+
+        self.stop()
+
+    def background(self, coro):
+        """Run a one-off coroutine in a task, keeping hold of it until it's
+        done and logging it if it fails. Unlike `spawn()`, the service keeps
+        running when it finishes."""
+        task = asyncio.ensure_future(self._run_once(coro))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _run_once(self, coro):
+        try:
+            await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("{} failed", coro.__qualname__)
+
+    def stop(self):
+        self.stopping.set()
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+
+        try:
+            await self.stopping.wait()
+        finally:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+            await self.shutdown()
+
+    async def shutdown(self):
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 def setup_logging(name, level):
     from logbook import NullHandler, RotatingFileHandler, lookup_level
     path = os.path.expanduser('~/.config/aesop/{}.log'.format(name))
@@ -1,4 +1,18 @@
 from setuptools import setup
+from setuptools.command.build_ext import build_ext
+
+
+class optional_build_ext(build_ext):
+    """Build the mpv extension if we can. Without it aesop.mpv loads libmpv
+    in ABI mode, so a missing compiler or mpv headers shouldn't fail the
+    install."""
+
+    def build_extension(self, ext):
+        try:
+            super().build_extension(ext)
+        except Exception as e:
+            self.warn('could not build {}, aesop.mpv will load libmpv in ABI mode: {}'.format(ext.name, e))
+
 
 setup(name='aesop',
       version='0.1',
@@ -6,4 +20,8 @@ setup(name='aesop',
       author='Nathan Hoad',
       author_email='nathan@getoffmalawn.com',
       packages=['aesop'],
+      setup_requires=['cffi>=1.0.0'],
+      cffi_modules=['aesop/_mpv_build.py:ffibuilder'],
+      cmdclass={'build_ext': optional_build_ext},
+      install_requires=['aiohttp>=3', 'cffi>=1.0.0', 'websockets>=14'],
      )
@@ -0,0 +1,61 @@
+import asyncio
+
+from aesop.bus import Broker, LocalBackend, UnixBackend
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+class TestLocalBackend:
+    def test_publish_subscribe(self):
+        async def go():
+            backend = LocalBackend(Broker())
+            subscriber = await backend.subscribe(['a'])
+
+            await backend.publish('b', 'ignored')
+            await backend.publish('a', '{"type": "test"}')
+
+            message = await subscriber.next_message()
+            subscriber.close()
+            return message
+
+        assert run(go()) == ('a', 'a', '{"type": "test"}')
+
+
+class TestUnixBackend:
+    def test_publish_subscribe(self, tmpdir):
+        path = str(tmpdir.join('events.sock'))
+
+        async def go():
+            broker = Broker()
+            server = await broker.serve(path)
+
+            backend = UnixBackend(path)
+            subscriber = await backend.subscribe(['a'])
+            # give the broker a chance to process the subscription.
+            await asyncio.sleep(0.05)
+
+            await backend.publish('a', '{"type": "test", "value": "with spaces"}')
+
+            message = await subscriber.next_message()
+            subscriber.close()
+            backend.close()
+            server.close()
+            await server.wait_closed()
+            return message
+
+        assert run(go()) == ('a', 'a', '{"type": "test", "value": "with spaces"}')
+
+
+class TestBroker:
+    def test_patterns(self):
+        broker = Broker()
+        received = []
+        broker.subscribe('events:*', lambda *message: received.append(message))
+        broker.subscribe('events:a', lambda *message: received.append(message))
+
+        broker.publish('events:a', '1')
+        broker.publish('other:a', '2')
+
+        assert sorted(received) == [('events:*', 'events:a', '1'), ('events:a', 'events:a', '1')]
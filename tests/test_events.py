@@ -0,0 +1,182 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from aesop import bus, events
+from aesop.events import ClientListener, ClientTooSlow, StateCache, decode
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def player(attribute, value):
+    return decode('{{"type": "player", "attribute": "{}", "value": {}}}'.format(attribute, value))
+
+
+def notification(message):
+    return decode('{{"type": "notification", "message": "{}"}}'.format(message))
+
+
+async def drain(listener):
+    events = []
+    while listener.pending or listener.player_changes:
+        events.append(await listener.wait())
+    return events
+
+
+class TestClientListener:
+    def test_player_changes_batched(self):
+        listener = ClientListener()
+        listener.put(player('volume', 10))
+        listener.put(player('progress_percent', 1))
+        listener.put(player('volume', 20))
+
+        events = run(drain(listener))
+        assert len(events) == 1
+        assert events[0].type == 'player-state'
+        assert events[0].changes == {'volume': 20, 'progress_percent': 1}
+
+    def test_unchanged_player_values_suppressed(self):
+        listener = ClientListener()
+        listener.put(player('volume', 10))
+        listener.put(player('length', 60))
+        run(drain(listener))
+
+        listener.put(player('volume', 10))
+        listener.put(player('length', 61))
+        events = run(drain(listener))
+        assert [e.changes for e in events] == [{'length': 61}]
+
+    def test_notifications_kept(self):
+        listener = ClientListener()
+        listener.put(notification('a'))
+        listener.put(player('volume', 10))
+        listener.put(notification('b'))
+
+        events = run(drain(listener))
+        assert [e.type for e in events] == ['notification', 'notification', 'player-state']
+
+    def test_private_ignored(self):
+        listener = ClientListener()
+        listener.put(decode('{"type": "new-client", "private": true}'))
+        assert not listener.pending
+
+    def test_too_slow(self):
+        listener = ClientListener(max_backlog=2)
+        for message in 'abc':
+            listener.put(notification(message))
+
+        with pytest.raises(ClientTooSlow):
+            run(listener.wait())
+
+
+class TestEvent:
+    def test_fields(self):
+        event = decode('{"type": "subtitle-downloaded", "path": "a.srt"}')
+        assert event.type == 'subtitle-downloaded'
+        assert event.path == 'a.srt'
+        assert event.private is False
+
+        with pytest.raises(AttributeError):
+            event.language
+
+    def test_raw_kept(self):
+        raw = '{"type": "notification", "message": "hi"}'
+        assert decode(raw).raw is raw
+
+
+class TestStateCache:
+    def test_snapshot(self):
+        state = StateCache()
+        state.put(player('volume', 10))
+        state.put(notification('a'))
+        state.put(player('volume', 20))
+        state.put(decode('{"type": "list-subtitles", "path": "a.mkv"}'))
+
+        snapshot = state.snapshot()
+        assert [e.type for e in snapshot] == ['player', 'notification']
+        assert snapshot[0].value == 20
+
+    def test_old_notifications_not_replayed(self, monkeypatch):
+        state = StateCache()
+        state.put(notification('a'))
+
+        monkeypatch.setattr(events, 'REPLAY_NOTIFICATION_AGE', -1)
+        assert state.snapshot() == []
+
+
+class TestSubscription:
+    def test_topics(self, monkeypatch):
+        monkeypatch.setattr(bus, '_backend', bus.LocalBackend(bus.Broker()))
+        monkeypatch.setattr(events, '_subscription', events.Subscription())
+
+        async def go():
+            wanted = events.listener('wanted')
+            everything = events.listener()
+            # let the subscription start.
+            await asyncio.sleep(0.01)
+
+            await events.broadcast('unwanted')
+            await events.broadcast('wanted', value=1)
+
+            first = await wanted.wait()
+            received = [await everything.wait(), await everything.wait()]
+
+            events._subscription.task.cancel()
+            await asyncio.sleep(0)
+            return first, received, everything.queue.empty()
+
+        first, received, empty = run(go())
+        assert first.value == 1
+        assert [e.type for e in received] == ['unwanted', 'wanted']
+        assert empty
+
+    def test_failed_subscribe_resubscribes(self, monkeypatch):
+        monkeypatch.setattr(bus, '_backend', bus.LocalBackend(bus.Broker()))
+        monkeypatch.setattr(bus, 'RECONNECT_DELAY', 0)
+        monkeypatch.setattr(events, '_subscription', events.Subscription())
+        subscribe = mock.AsyncMock(side_effect=ConnectionError('lost'))
+
+        async def go():
+            events.listener('first')
+            await asyncio.sleep(0.01)
+
+            with mock.patch.object(bus.LocalSubscriber, 'subscribe', subscribe):
+                second = events.listener('second')
+                await asyncio.sleep(0.01)
+
+            await events.broadcast('second', value=1)
+            event = await asyncio.wait_for(second.wait(), 1)
+            await events._subscription.close()
+            return event
+
+        assert run(go()).value == 1
+        subscribe.assert_called_once_with([events.channel('second')])
+
+
+class TestServer:
+    def test_topics(self, monkeypatch):
+        websockets = pytest.importorskip('websockets')
+
+        state = StateCache()
+        state.put(player('volume', 10))
+        state.put(notification('a'))
+        monkeypatch.setattr(events, '_state', state)
+        monkeypatch.setattr(events, '_subscription', events.Subscription())
+
+        async def go():
+            server = await websockets.serve(events.server, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+
+            async with websockets.connect('ws://127.0.0.1:{}/?topics=player'.format(port)) as websocket:
+                message = await asyncio.wait_for(websocket.recv(), 1)
+
+            server.close()
+            await server.wait_closed()
+            return message
+
+        message = decode(run(go()))
+        assert message.type == 'player-state'
+        assert message.changes == {'volume': 10}
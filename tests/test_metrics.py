@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from aesop import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = metrics.OrderedDict()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    return registry
+
+
+def test_render(registry):
+    metrics.counter('requests_total', 'Requests').inc(3)
+    metrics.gauge('clients', 'Clients', lambda: 2)
+
+    histogram = metrics.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert metrics.render().splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total 3.0',
+        '# HELP clients Clients',
+        '# TYPE clients gauge',
+        'clients 2.0',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 1.0',
+        'latency_seconds_bucket{le="1"} 2.0',
+        'latency_seconds_bucket{le="+Inf"} 3.0',
+        'latency_seconds_sum 5.55',
+        'latency_seconds_count 3.0',
+    ]
+
+
+def test_registered_once(registry):
+    assert metrics.counter('a', 'A') is metrics.counter('a', 'A')
+
+
+def test_serve(registry):
+    metrics.counter('requests_total', 'Requests').inc()
+
+    async def go():
+        server = await asyncio.start_server(metrics._handle_request, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /metrics HTTP/1.0\r\nHost: localhost\r\n\r\n')
+        response = await reader.read()
+        writer.close()
+
+        server.close()
+        await server.wait_closed()
+        return response
+
+    response = asyncio.run(go())
+
+    assert response.startswith(b'HTTP/1.0 200 OK\r\n')
+    assert response.endswith(b'requests_total 1.0\n')
@@ -0,0 +1,107 @@
+import asyncio
+import itertools
+from unittest import mock
+
+import pytest
+
+from aesop.mpv import AsyncioClient, Client, Event, LoadFile, Property, PropertyChange, Track, TrackList, libmpv
+
+
+class TestProperties:
+    def test_accessors_created(self):
+        assert isinstance(Client.time_pos, Property)
+        assert Client.time_pos.encoded == b'time-pos'
+        assert Client.accessors['time-pos'] is Client.time_pos
+
+    def test_access_checked(self):
+        client = Client.__new__(Client)
+
+        with pytest.raises(AttributeError):
+            client.path = 'a.mkv'
+
+        with pytest.raises(AttributeError):
+            client.program
+
+
+class TestTrackList:
+    def test_partitioned(self):
+        tracks = [
+            Track.from_dict({'id': 1, 'type': 'video', 'selected': 1}),
+            Track.from_dict({'id': 1, 'type': 'audio', 'lang': 'jpn', 'selected': 1}),
+            Track.from_dict({'id': 2, 'type': 'audio', 'lang': 'eng'}),
+            Track.from_dict({'id': 1, 'type': 'sub'}),
+        ]
+
+        track_list = TrackList.from_tracks(tracks, display=lambda track: track.lang or 'Unknown')
+
+        assert [t.id for t in track_list.video] == [1]
+        assert [t.display for t in track_list.audio] == ['jpn', 'eng']
+        assert track_list.selected('audio').lang == 'jpn'
+        assert track_list.selected('sub') is None
+        assert track_list.sub[0].display == 'Unknown'
+
+
+class TestAsyncioClient:
+    def run(self, events, request):
+        """Run `request` against a client whose mpv handle replies with the
+        given events, returning the request's result and the queued events."""
+        async def go():
+            client = AsyncioClient.__new__(AsyncioClient)
+            client.mpv = mock.Mock()
+            client.fd = 0
+            client.event_loop = asyncio.get_running_loop()
+            client.event_queue = asyncio.Queue()
+            client.reply_ids = itertools.count(1)
+            client.replies = {}
+
+            def reply(*args):
+                client.event_loop.call_soon(client._read_events)
+
+            with mock.patch('aesop.mpv.command_async', side_effect=reply), \
+                    mock.patch('aesop.mpv.get_property_async', side_effect=reply), \
+                    mock.patch('aesop.mpv.os.read'), \
+                    mock.patch('aesop.mpv.libmpv.mpv_wait_event', side_effect=[
+                        mock.Mock(event_id=event.id) for event in events
+                    ] + [mock.Mock(event_id=libmpv.MPV_EVENT_NONE)]), \
+                    mock.patch('aesop.mpv.decode_event', side_effect=events):
+                result = await request(client)
+
+            queued = []
+            while not client.event_queue.empty():
+                queued.append(client.event_queue.get_nowait())
+            return result, queued, client.replies
+
+        return asyncio.run(go())
+
+    def test_get_property_reply(self):
+        events = [
+            Event(libmpv.MPV_EVENT_FILE_LOADED, 0, 0, None),
+            Event(libmpv.MPV_EVENT_GET_PROPERTY_REPLY, 0, 1, PropertyChange('volume', 50.0)),
+        ]
+
+        result, queued, replies = self.run(events, lambda client: client.get_property_async('volume'))
+
+        assert result == 50.0
+        assert queued == events[:1]
+        assert replies == {}
+
+    def test_command_error(self):
+        events = [Event(libmpv.MPV_EVENT_COMMAND_REPLY, -12, 1, None)]
+
+        with mock.patch('aesop.mpv.error_string', return_value='error running command'):
+            with pytest.raises(ValueError):
+                self.run(events, lambda client: client.loadfile_async('a.mkv'))
+
+    @pytest.mark.parametrize('version, args', [
+        ((2, 2), ('loadfile', 'a.mkv', 'append', 'start=60')),
+        ((2, 3), ('loadfile', 'a.mkv', 'append', '-1', 'start=60')),
+    ])
+    def test_loadfile_options(self, version, args):
+        """mpv 0.38 takes an index before loadfile's options."""
+        client = AsyncioClient.__new__(AsyncioClient)
+        client.command_async = mock.AsyncMock()
+
+        with mock.patch('aesop.mpv.client_api_version', return_value=version):
+            asyncio.run(client.loadfile_async('a.mkv', LoadFile.Append, start=60))
+
+        client.command_async.assert_called_once_with(*args)
@@ -1,18 +1,21 @@
 import asyncio
+import os
 from unittest import mock
 
 import pytest
 
-from aesop.mpv import Client
-from aesop.player import Server, VideoPlayer
+from aesop.models import Movie
+from aesop.mpv import AsyncioClient, Event, PropertyChange, Seek, Track, TrackList, libmpv
+from aesop.player import MediaCache, MediaInfo, ResumeTracker, Server, Throttle, VideoPlayer, write_playlist
 
 
-@pytest.yield_fixture
+@pytest.fixture
 def server():
     v = Server()
     v.player = mock.MagicMock(VideoPlayer)
-    v.player.client = mock.Mock(Client)
-    with mock.patch('aesop.player.broadcast_player_property', return_value=result(None)):
+    v.player.client = mock.Mock(AsyncioClient)
+    v.player.media = MediaCache()
+    with mock.patch('aesop.player.broadcast_player_property', new_callable=mock.AsyncMock):
         with mock.patch('aesop.models.BaseModel.select'):
             yield v
 
@@ -21,15 +24,7 @@ def run(coro):
     if coro is None:
         return
 
-    loop = asyncio.new_event_loop()
-    loop.run_until_complete(coro)
-    loop.close()
-
-
-def result(value):
-    f = asyncio.Future()
-    f.set_result(value)
-    return f
+    return asyncio.run(coro)
 
 
 class TestServer:
@@ -54,6 +49,18 @@ class TestServer:
     def test_ws_queue_season(self, server):
         run(server.ws_queue_season(1, 2))
 
+    def test_ws_play_season_single_load(self, server):
+        episodes = [mock.Mock(path='s01e0{}.mkv'.format(i), title=str(i)) for i in (1, 2, 3)]
+
+        with mock.patch('aesop.player.TVShowEpisode.select') as select, \
+                mock.patch('aesop.player.Config.get', return_value='1'):
+            select.return_value.join.return_value.where.return_value.order_by.return_value.where.return_value = episodes
+            run(server.ws_play_season(1, 1))
+
+        server.player.play_all.assert_called_once_with(
+            ['s01e01.mkv', 's01e02.mkv', 's01e03.mkv'], append=False)
+        server.player.broadcast_queue.assert_called_once_with()
+
     def test_ws_seek_backward(self, server):
         run(server.ws_seek_backward())
 
@@ -71,3 +78,203 @@ class TestServer:
 
     def test_ws_volume(self, server):
         run(server.ws_volume(50))
+
+
+class TestThrottle:
+    def test_rate_limited(self):
+        async def go():
+            throttle = Throttle(0.05)
+            throttle.update('time_pos', 1)
+            throttle.update('time_pos', 2)
+            throttle.update('time_pos', 3)
+            throttle.update('length', 60)
+            await asyncio.sleep(0.1)
+
+        with mock.patch('aesop.player.broadcast_player_property', new_callable=mock.AsyncMock) as broadcast:
+            run(go())
+
+        assert broadcast.call_args_list == [
+            mock.call('time_pos', 1),
+            mock.call('length', 60),
+            mock.call('time_pos', 3),
+        ]
+
+    def test_unchanged_not_sent(self):
+        async def go():
+            throttle = Throttle(0)
+            throttle.update('volume', 50.0)
+            throttle.update('volume', 50.0)
+            await asyncio.sleep(0)
+
+        with mock.patch('aesop.player.broadcast_player_property', new_callable=mock.AsyncMock) as broadcast:
+            run(go())
+
+        assert broadcast.call_args_list == [mock.call('volume', 50.0)]
+
+
+    def test_finished_broadcasts_released(self):
+        errors = []
+
+        async def go():
+            asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+            throttle = Throttle(0)
+            throttle.update('volume', 50.0)
+            await asyncio.sleep(0.01)
+            return throttle
+
+        with mock.patch('aesop.player.broadcast_player_property', new_callable=mock.AsyncMock):
+            throttle = run(go())
+
+        assert throttle.sending == set()
+        assert errors == []
+
+
+class TestResumeTracker:
+    def test_batched(self):
+        tracker = ResumeTracker()
+
+        with mock.patch('aesop.player.ResumePoint.save_positions') as save:
+            tracker.start('a.mkv')
+            for position in range(100):
+                tracker.update(position)
+            tracker.flush()
+            tracker.flush()
+
+            tracker.start('b.mkv')
+            tracker.update(5)
+            tracker.finished()
+            tracker.flush()
+
+        assert save.call_args_list == [
+            mock.call({'a.mkv': 99}),
+            mock.call({'b.mkv': None}),
+        ]
+
+
+class TestMediaCache:
+    def test_looked_up_once(self):
+        cache = MediaCache()
+        cache.add('a.mkv', MediaInfo('A', 'movie', 1))
+
+        with mock.patch('aesop.player.lookup_media', return_value=MediaInfo('B', 'tvshow', 2)) as lookup:
+            assert cache.get('a.mkv').title == 'A'
+            assert cache.get('b.mkv').title == 'B'
+            assert cache.get('b.mkv').title == 'B'
+
+            cache.clear()
+            cache.get('a.mkv')
+
+        assert lookup.call_args_list == [mock.call('b.mkv'), mock.call('a.mkv')]
+
+
+class TestVideoPlayer:
+    def test_season_resumed_on_load(self):
+        """Episodes queued through a playlist get no start=, so they're
+        resumed once loaded, while a file loaded with start= isn't sought
+        again."""
+        positions = {'/tv/s01e01.mkv': 300, '/tv/s01e02.mkv': 600}
+
+        async def go():
+            player = VideoPlayer()
+            player.media.add('/tv/s01e01.mkv', MediaInfo('1', 'tvshow', 1))
+            player.media.add('/tv/s01e02.mkv', MediaInfo('2', 'tvshow', 2))
+
+            await player.play_all(['/tv/s01e01.mkv', '/tv/s01e02.mkv'])
+            await player.play('/tv/s01e02.mkv', append=True)
+
+            player.client.event_queue = asyncio.Queue()
+            for path in ('/tv/s01e01.mkv', '/tv/s01e02.mkv'):
+                player.client.path = path
+                player.client.event_queue.put_nowait(Event(libmpv.MPV_EVENT_FILE_LOADED, 0, 0, None))
+                task = asyncio.ensure_future(player.client_event_handler())
+                await asyncio.sleep(0.01)
+                task.cancel()
+            return player.client
+
+        with mock.patch('aesop.player.AsyncioClient', return_value=mock.Mock(AsyncioClient)), \
+                mock.patch('aesop.player.ResumePoint.position_for', side_effect=positions.get), \
+                mock.patch('aesop.player.VideoPlayer.add_available_srt_subtitles', new_callable=mock.AsyncMock), \
+                mock.patch('aesop.player.events.info', new_callable=mock.AsyncMock), \
+                mock.patch('aesop.player.broadcast_player_property', new_callable=mock.AsyncMock):
+            client = run(go())
+
+        client.loadfile_async.assert_called_once_with('/tv/s01e02.mkv', add_mode=mock.ANY, start=600)
+        client.seek_async.assert_called_once_with(300, Seek.Absolute)
+
+    def test_play_all_removes_playlist(self):
+        with mock.patch('aesop.player.AsyncioClient', return_value=mock.Mock(AsyncioClient)):
+            player = VideoPlayer()
+
+        run(player.play_all(['/a/1.mkv', '/a/2.mkv']))
+
+        (playlist,), kwargs = player.client.loadlist_async.call_args
+        assert not os.path.exists(playlist)
+
+    def test_queue_is_whole_playlist(self):
+        with mock.patch('aesop.player.AsyncioClient'):
+            player = VideoPlayer()
+
+        player.client.playlist_items.return_value = [
+            {'filename': '/tv/s01e01.mkv', 'current': True},
+            {'filename': '/tv/s02e01.mkv'},
+            {'filename': '/other/video.mkv'},
+        ]
+        player.media.add('/tv/s01e01.mkv', MediaInfo('Show - Season 1, Episode 1', 'tvshow', 1))
+        player.media.add('/tv/s02e01.mkv', MediaInfo('Show - Season 2, Episode 1', 'tvshow', 2))
+
+        with mock.patch('aesop.player.lookup_media', side_effect=Movie.DoesNotExist):
+            assert player.queue() == [
+                'Show - Season 1, Episode 1',
+                'Show - Season 2, Episode 1',
+                'video.mkv',
+            ]
+
+
+    def test_property_change_broadcast(self):
+        async def go():
+            player = VideoPlayer(broadcast_interval=0)
+            player.client.event_queue = asyncio.Queue()
+            player.client.event_queue.put_nowait(Event(
+                libmpv.MPV_EVENT_PROPERTY_CHANGE, 0, 0, PropertyChange('time-pos', 12.7)))
+
+            task = asyncio.ensure_future(player.client_event_handler())
+            await asyncio.sleep(0.01)
+            task.cancel()
+
+        with mock.patch('aesop.player.AsyncioClient'):
+            with mock.patch('aesop.player.broadcast_player_property', new_callable=mock.AsyncMock) as broadcast:
+                run(go())
+
+        assert broadcast.call_args_list == [mock.call('time_pos', 12)]
+
+    def test_tracks_broadcast_when_added(self):
+        """Selecting a different track only refreshes the tracks, while adding
+        one broadcasts them too."""
+        english = Track(1, 'sub', 'eng', None, False, False, None)
+        french = Track(2, 'sub', 'fre', None, False, False, None)
+
+        with mock.patch('aesop.player.AsyncioClient'):
+            player = VideoPlayer()
+        player.update_track_info = mock.AsyncMock()
+        player.client.tracks.side_effect = [
+            TrackList.from_tracks([english]),
+            TrackList.from_tracks([english._replace(selected=True)]),
+            TrackList.from_tracks([english._replace(selected=True), french]),
+        ]
+
+        for _ in range(3):
+            run(player.tracks_changed())
+
+        assert player.update_track_info.call_count == 2
+        assert player.tracks.selected('sub') == english._replace(selected=True)
+
+
+def test_write_playlist():
+    playlist = write_playlist(['/a/1.mkv', '/a/2.mkv'])
+
+    try:
+        assert playlist.endswith('.m3u')
+        with open(playlist) as f:
+            assert f.read() == '#EXTM3U\n/a/1.mkv\n/a/2.mkv\n'
+    finally:
+        os.remove(playlist)
@@ -0,0 +1,63 @@
+import asyncio
+
+from aesop import utils
+from aesop.utils import Supervisor
+
+
+def test_supervisor_restarts_failed_tasks(monkeypatch):
+    monkeypatch.setattr(utils, 'RESTART_DELAY', 0)
+    calls = []
+
+    async def flaky():
+        calls.append(None)
+        if len(calls) < 3:
+            raise ValueError('failed')
+
+    async def go():
+        supervisor = Supervisor()
+        supervisor.spawn(flaky)
+        # returning stops the service.
+        await asyncio.wait_for(supervisor.stopping.wait(), 1)
+        await supervisor.shutdown()
+
+    asyncio.run(go())
+    assert len(calls) == 3
+
+
+def test_supervisor_background_tasks_kept_until_done():
+    async def fails():
+        raise ValueError('failed')
+
+    async def go():
+        supervisor = Supervisor()
+        task = supervisor.background(fails())
+        assert supervisor.tasks == {task}
+        await task
+        return supervisor
+
+    supervisor = asyncio.run(go())
+    assert supervisor.tasks == set()
+    # a one-off task finishing doesn't stop the service.
+    assert not supervisor.stopping.is_set()
+
+
+def test_supervisor_shutdown_cancels_tasks():
+    cancelled = []
+
+    async def forever():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(None)
+            raise
+
+    async def go():
+        supervisor = Supervisor()
+        supervisor.spawn(forever)
+        await asyncio.sleep(0)
+        supervisor.stop()
+        await supervisor.wait()
+        return supervisor.tasks
+
+    assert asyncio.run(go()) == set()
+    assert cancelled == [None]